@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""Parse a generated corpus of PKGBUILDs with PkgData and report throughput"""
+
+from argparse import ArgumentParser
+from os.path import realpath, dirname, getsize, join as path_join
+from tempfile import TemporaryDirectory
+from random import Random
+from time import perf_counter
+import sys
+
+sys.path.insert(0, dirname(dirname(realpath(__file__))))
+
+from pkgdata import PkgData
+
+
+def generate_pkgbuild(rng, index):
+	"""A synthetic PKGBUILD, with a size that varies from a few lines to a few hundred"""
+	name = 'pkg{}'.format(index)
+	deps = ['dep{}'.format(rng.randrange(1000)) for i in range(rng.randrange(0, 20))]
+	sources = ['https://example.com/{0}/{0}-$pkgver-{1}.tar.gz'.format(name, i) for i in range(rng.randrange(1, 30))]
+	body = ['\tcd "$srcdir/{0}-$pkgver"'.format(name)] + ['\tmake target{}'.format(i) for i in range(rng.randrange(1, 300))]
+
+	return '\n'.join([
+		'# Maintainer: Benchmark <bench@example.com>',
+		'pkgname={}'.format(name),
+		'pkgver={0}.{1}'.format(rng.randrange(10), rng.randrange(100)),
+		'pkgrel=1',
+		'pkgdesc="Synthetic package number {}"'.format(index),
+		"arch=('x86_64' 'i686')",
+		"url='https://example.com/{}'".format(name),
+		"license=('GPL')",
+		'depends=(' + '\n         '.join("'{}'".format(d) for d in deps) + ')',
+		"optdepends=('python: for scripts' 'perl: for other scripts')",
+		'source=(' + '\n        '.join('"{}"'.format(s) for s in sources) + ')',
+		'sha256sums=(' + '\n            '.join("'{:064x}'".format(rng.getrandbits(256)) for s in sources) + ')',
+		'',
+		'build() {'] + body + [
+		'}',
+		'',
+		'package() {',
+		'\tmake DESTDIR="$pkgdir" install',
+		'}',
+		''])
+
+
+def generate_corpus(directory, count, seed = 0):
+	rng = Random(seed)
+	paths = []
+	for i in range(count):
+		path = path_join(directory, 'PKGBUILD.{}'.format(i))
+		with open(path, 'w') as f:
+			f.write(generate_pkgbuild(rng, i))
+
+		paths.append(path)
+
+	return paths
+
+
+def bench_parse(paths, repeat = 3):
+	"""Best wall time over repeat runs of parsing every path"""
+	best = None
+	for r in range(repeat):
+		start = perf_counter()
+		for path in paths:
+			PkgData().parse(path)
+
+		elapsed = perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+
+	return best
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description=__doc__)
+	parser.add_argument('-n', '--count', type=int, default=10000)
+	parser.add_argument('-r', '--repeat', type=int, default=3)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	with TemporaryDirectory() as directory:
+		paths = generate_corpus(directory, args.count, args.seed)
+		size = sum(getsize(p) for p in paths)
+		elapsed = bench_parse(paths, args.repeat)
+
+	print('parsed {0} PKGBUILDs ({1:.1f} MiB) in {2:.3f}s'.format(len(paths), size / float(1 << 20), elapsed))
+	print('{0:.0f} PKGBUILDs/s, {1:.1f} MiB/s'.format(len(paths) / elapsed, size / float(1 << 20) / elapsed))
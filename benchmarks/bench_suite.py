@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""End-to-end benchmarks of each phase of a build, with JSON output and a regression check
+
+	bench_suite.py -o results.json                 run every case
+	bench_suite.py -o new.json --compare old.json  run, then fail if a case got slower
+	bench_suite.py --compare old.json new.json     only compare two result files"""
+
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from os import makedirs, devnull
+from os.path import realpath, dirname, getsize, join as path_join
+from platform import python_version, platform
+from tempfile import TemporaryDirectory
+from random import Random
+from time import perf_counter, time
+from hashlib import sha256
+from json import load as json_load, dump as json_dump, loads as json_loads
+from subprocess import run as run_cmd, PIPE
+import sys
+
+ROOT = dirname(dirname(realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pkgdata import PkgData
+from control import ControlData
+from extract import Extractor
+from debwriter import DebWriter
+from pkgdownload import PkgDownloadManager
+from mirrors import MirrorMap
+from makedebpkg import expand_vars
+from bench_parse import generate_pkgbuild, generate_corpus
+from httpstub import StubServer, generate_tree, make_tarball, make_zip, payload
+
+MiB = float(1 << 20)
+
+# Cases are compared on their best wall time
+CASES = []
+
+
+def case(function):
+	CASES.append(function)
+	return function
+
+
+def best_of(repeat, function, setup = None):
+	"""Best wall time of function() over repeat runs, with setup() run untimed before each one"""
+	best = None
+	with open(devnull, 'w') as null, redirect_stdout(null):
+		for r in range(repeat):
+			state = setup() if setup else None
+			start = perf_counter()
+			function(state) if setup else function()
+			elapsed = perf_counter() - start
+			best = elapsed if best is None else min(best, elapsed)
+
+	return best
+
+
+@case
+def parse(workdir, args):
+	makedirs(path_join(workdir, 'parse'))
+	paths = generate_corpus(path_join(workdir, 'parse'), args.pkgbuilds, args.seed)
+	size = sum(getsize(p) for p in paths)
+	seconds = best_of(args.repeat, lambda: [PkgData().parse(p) for p in paths])
+	return {'seconds': seconds, 'files_per_second': len(paths) / seconds, 'mib_per_second': size / MiB / seconds}
+
+
+@case
+def expand(workdir, args):
+	rng = Random(args.seed)
+	texts = [generate_pkgbuild(rng, i) for i in range(args.pkgbuilds // 10 or 1)]
+
+	def setup():
+		parsed = []
+		for text in texts:
+			pkgdata = PkgData()
+			pkgdata.parse_text(text)
+			parsed.append(pkgdata)
+		return parsed
+
+	seconds = best_of(args.repeat, lambda parsed: [expand_vars(p, '/build/src', '/build/pkg') for p in parsed], setup)
+	return {'seconds': seconds, 'pkgbuilds_per_second': len(texts) / seconds}
+
+
+def empty_dirs(workdir, prefix):
+	"""setup() for best_of, giving every run an empty directory"""
+	counter = [0]
+
+	def setup():
+		counter[0] += 1
+		target = path_join(workdir, '{0}{1}'.format(prefix, counter[0]))
+		makedirs(target)
+		return target
+
+	return setup
+
+
+@case
+def download(workdir, args):
+	rng = Random(args.seed)
+	files = {'blob{}.bin'.format(i): payload(rng, args.download_size << 20) for i in range(4)}
+
+	with StubServer(files) as server:
+		def fetch(target):
+			manager = PkgDownloadManager(target, len(files))
+			for result in manager.fetch_all([server.url(n) for n in sorted(files)], ('sha256',)):
+				if not result.ok:
+					raise result.error
+
+		seconds = best_of(args.repeat, fetch, empty_dirs(workdir, 'download'))
+
+	size = sum(len(d) for d in files.values())
+	return {'seconds': seconds, 'mib_per_second': size / MiB / seconds}
+
+
+def fetch_checked(manager, urls, files):
+	for result in manager.fetch_all(urls, ('sha256',)):
+		if not result.ok:
+			raise result.error
+		if result.digests['sha256'] != sha256(files[result.filename]).hexdigest():
+			raise ValueError('{}: corrupted download'.format(result.filename))
+
+
+@case
+def keepalive(workdir, args):
+	"""Many small files from one host, where connection set-up dominates"""
+	rng = Random(args.seed)
+	files = {'small{}.bin'.format(i): payload(rng, 16 << 10) for i in range(64)}
+
+	with StubServer(files) as server:
+		seconds = best_of(args.repeat, lambda target: fetch_checked(PkgDownloadManager(target, 4), [server.url(n) for n in sorted(files)], files), empty_dirs(workdir, 'keepalive'))
+		connections = server.connections / float(args.repeat)
+
+	return {'seconds': seconds, 'files_per_second': len(files) / seconds, 'connections_per_run': connections}
+
+
+@case
+def mirrors(workdir, args):
+	"""A slow upstream with two mirrors: the fastest one breaks off halfway, and the transfer resumes from the other"""
+	rng = Random(args.seed)
+	files = {'blob{}.bin'.format(i): payload(rng, args.download_size << 20) for i in range(2)}
+	size = args.download_size << 19
+
+	with StubServer(files, delay=0.2) as upstream, StubServer(files, cut_after=size) as broken, StubServer(files, delay=0.02) as good:
+		mirror_map = MirrorMap({upstream.root(): [good.root(), broken.root()]})
+
+		def fetch(target):
+			fetch_checked(PkgDownloadManager(target, len(files), mirrors=mirror_map), [upstream.url(n) for n in sorted(files)], files)
+
+		seconds = best_of(args.repeat, fetch, empty_dirs(workdir, 'mirrors'))
+
+	size = sum(len(d) for d in files.values())
+	return {'seconds': seconds, 'mib_per_second': size / MiB / seconds}
+
+
+# Imports timed in a fresh interpreter, reporting the seconds taken and the modules loaded
+IMPORT_PROBE = """
+import sys
+from time import perf_counter
+start = perf_counter()
+{}
+print('{{"seconds": %r, "modules": %d, "git": %s}}' % (perf_counter() - start, len(sys.modules), str('git' in sys.modules).lower()))
+"""
+
+
+def import_time(statement, repeat):
+	best = None
+	for r in range(repeat):
+		process = run_cmd([sys.executable, '-c', IMPORT_PROBE.format(statement)], cwd=ROOT, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+		if process.returncode != 0:
+			return None
+		probe = json_loads(process.stdout)
+		best = probe if best is None or probe['seconds'] < best['seconds'] else best
+
+	return best
+
+
+@case
+def imports(workdir, args):
+	"""Start-up cost of a plain tarball build, and what loading the git backend would add to it"""
+	plain = import_time('import makedebpkg', args.repeat)
+	result = {'seconds': plain['seconds'], 'modules': plain['modules'], 'loads_git': plain['git']}
+
+	# Only where GitPython is installed
+	git = import_time('import makedebpkg, gitcache', args.repeat)
+	if git:
+		result.update(git_backend_seconds=git['seconds'] - plain['seconds'], git_backend_modules=git['modules'] - plain['modules'])
+
+	return result
+
+
+def extract_case(workdir, args, name, data, unpacked):
+	new_dir = empty_dirs(workdir, 'extract-{}-'.format(name))
+
+	def setup():
+		target = new_dir()
+		with open(path_join(target, name), 'wb') as f:
+			f.write(data)
+		return Extractor(target), path_join(target, name)
+
+	seconds = best_of(args.repeat, lambda state: state[0].extract(state[1]), setup)
+	return {'seconds': seconds, 'mib_per_second': unpacked / MiB / seconds}
+
+
+@case
+def extract_tar(workdir, args):
+	tree = generate_tree(Random(args.seed), args.files, args.tree_size << 20)
+	return extract_case(workdir, args, 'tree.tar.gz', make_tarball(tree, 'tree'), sum(len(d) for d in tree.values()))
+
+
+@case
+def extract_zip(workdir, args):
+	tree = generate_tree(Random(args.seed), args.files, args.tree_size << 20)
+	return extract_case(workdir, args, 'tree.zip', make_zip(tree, 'tree'), sum(len(d) for d in tree.values()))
+
+
+@case
+def control(workdir, args):
+	pkgdata = PkgData()
+	pkgdata.parse_text(generate_pkgbuild(Random(args.seed), 0))
+	count = 10000
+	seconds = best_of(args.repeat, lambda: [ControlData().import_from_pkgdata(pkgdata, 'Bench <b@example.com>').dumps() for i in range(count)])
+	return {'seconds': seconds, 'controls_per_second': count / seconds}
+
+
+@case
+def deb(workdir, args):
+	tree = generate_tree(Random(args.seed), args.files, args.tree_size << 20)
+	pkgdir = path_join(workdir, 'pkg')
+	for name, data in tree.items():
+		path = path_join(pkgdir, 'usr/share/bench', name)
+		makedirs(dirname(path), exist_ok=True)
+		with open(path, 'wb') as f:
+			f.write(data)
+
+	con = ControlData()
+	con.package, con.version, con.architecture, con.maintainer = 'bench', '1.0-1', ['all'], 'Bench <b@example.com>'
+	writer = DebWriter(args.compression)
+	seconds = best_of(args.repeat, lambda: writer.write(pkgdir, pkgdir + '.deb', con))
+	size = sum(len(d) for d in tree.values())
+	return {'seconds': seconds, 'mib_per_second': size / MiB / seconds, 'deb_bytes': getsize(pkgdir + '.deb')}
+
+
+def run(args):
+	results = {}
+	with TemporaryDirectory() as workdir:
+		for function in CASES:
+			if args.cases and function.__name__ not in args.cases:
+				continue
+
+			results[function.__name__] = function(workdir, args)
+			print('{0:<12} {1:.4f}s'.format(function.__name__, results[function.__name__]['seconds']))
+
+	return {
+		'meta': {'time': time(), 'python': python_version(), 'platform': platform(), 'repeat': args.repeat},
+		'results': results
+	}
+
+
+def compare(baseline, current, threshold):
+	"""Print the change of every case, returning the names of those slower than threshold percent"""
+	regressions = []
+	for name, result in sorted(current['results'].items()):
+		if name not in baseline['results']:
+			continue
+
+		before, after = baseline['results'][name]['seconds'], result['seconds']
+		change = (after - before) / before * 100
+		flag = ''
+		if change > threshold:
+			regressions.append(name)
+			flag = '  REGRESSION'
+
+		print('{0:<12} {1:.4f}s -> {2:.4f}s  {3:+.1f}%{4}'.format(name, before, after, change, flag))
+
+	return regressions
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description=__doc__.split('\n')[0])
+	parser.add_argument('cases', nargs='*', help='cases to run, among: ' + ', '.join(f.__name__ for f in CASES))
+	parser.add_argument('-o', '--output', help='write the results to this JSON file')
+	parser.add_argument('-r', '--repeat', type=int, default=3)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--pkgbuilds', type=int, default=1000, help='PKGBUILDs to parse')
+	parser.add_argument('--files', type=int, default=500, help='files in generated source trees')
+	parser.add_argument('--tree-size', type=int, default=32, help='size of generated source trees, in MiB')
+	parser.add_argument('--download-size', type=int, default=16, help='size of each downloaded file, in MiB')
+	parser.add_argument('--compression', default='xz')
+	parser.add_argument('--compare', nargs='+', metavar='JSON', help='baseline results, and optionally results to compare instead of running')
+	parser.add_argument('--threshold', type=float, default=10.0, help='slowdown, in percent, counted as a regression')
+	args = parser.parse_args()
+
+	if args.compare and len(args.compare) > 1:
+		with open(args.compare[1]) as f:
+			current = json_load(f)
+	else:
+		current = run(args)
+		if args.output:
+			with open(args.output, 'w') as f:
+				json_dump(current, f, indent=1)
+
+	if args.compare:
+		with open(args.compare[0]) as f:
+			baseline = json_load(f)
+
+		regressions = compare(baseline, current, args.threshold)
+		if regressions:
+			print('{0} case(s) regressed by more than {1}%: {2}'.format(len(regressions), args.threshold, ', '.join(regressions)), file=sys.stderr)
+			exit(1)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""Local stand-in for an upstream HTTP server, serving generated archives from memory"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+from hashlib import sha1
+from io import BytesIO
+from threading import Thread
+from time import sleep
+import tarfile
+import zipfile
+
+
+def payload(rng, size):
+	"""size bytes that compress roughly like source code: repeated words with some noise"""
+	words = [bytes(rng.choice(b'abcdefghijklmnopqrstuvwxyz_') for i in range(rng.randrange(2, 12))) for i in range(512)]
+	out = bytearray()
+	while len(out) < size:
+		out += b' '.join(rng.choice(words) for i in range(12)) + b'\n'
+
+	return bytes(out[:size])
+
+
+def generate_tree(rng, files, size):
+	"""name -> content for a source tree of files files totalling about size bytes"""
+	tree = {}
+	for i in range(files):
+		name = 'src/dir{0}/file{1}.c'.format(i % 16, i)
+		tree[name] = payload(rng, max(1, size // files))
+
+	return tree
+
+
+def make_tarball(tree, top, mode = 'w:gz'):
+	buffer = BytesIO()
+	with tarfile.open(fileobj=buffer, mode=mode) as tar:
+		for name, data in sorted(tree.items()):
+			info = tarfile.TarInfo('{0}/{1}'.format(top, name))
+			info.size = len(data)
+			info.mtime = 1500000000
+			tar.addfile(info, BytesIO(data))
+
+	return buffer.getvalue()
+
+
+def make_zip(tree, top):
+	buffer = BytesIO()
+	with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+		for name, data in sorted(tree.items()):
+			z.writestr('{0}/{1}'.format(top, name), data)
+
+	return buffer.getvalue()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+	"""Serves self.server.files with Content-Length, Content-Disposition, ETag and Last-Modified
+
+	self.server.delay is added before every response, and a server with
+	cut_after set drops the connection once it has sent the file up to
+	that offset, like a mirror failing mid-transfer."""
+	protocol_version = 'HTTP/1.1'
+	# Headers and body are separate writes: Nagle's algorithm would hold the body back on kept-alive connections
+	disable_nagle_algorithm = True
+
+	def log_message(self, format, *args):
+		pass
+
+
+	def setup(self):
+		super(StubHandler, self).setup()
+		self.server.connections += 1
+
+
+	def do_GET(self):
+		sleep(self.server.delay)
+
+		# Served under a path that does not give the filename away, like most mirrors' redirectors
+		name = self.path.rsplit('/', 1)[-1]
+		data = self.server.files.get(name)
+		if data is None:
+			self.send_error(404)
+			return
+
+		etag = '"{}"'.format(sha1(data).hexdigest())
+		if self.headers.get('If-None-Match') == etag:
+			self.send_response(304)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+
+		start, end = 0, len(data)
+		if self.headers.get('Range', '').startswith('bytes='):
+			first, sep, last = self.headers['Range'][6:].partition('-')
+			start = int(first or 0)
+			end = min(end, int(last) + 1) if last else end
+
+		if start >= len(data) and data:
+			self.send_response(416)
+			self.send_header('Content-Range', 'bytes */{}'.format(len(data)))
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+
+		partial = start or end < len(data)
+		self.send_response(206 if partial else 200)
+		self.send_header('Content-Type', 'application/octet-stream')
+		self.send_header('Content-Disposition', 'attachment; filename="{}"'.format(name))
+		self.send_header('Content-Length', str(end - start))
+		self.send_header('Accept-Ranges', 'bytes')
+		self.send_header('ETag', etag)
+		self.send_header('Last-Modified', formatdate(1500000000, usegmt=True))
+		if partial:
+			self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end - 1, len(data)))
+		self.end_headers()
+
+		if self.server.cut_after is not None and end > self.server.cut_after:
+			self.wfile.write(data[start:max(start, self.server.cut_after)])
+			self.close_connection = True
+			return
+
+		self.wfile.write(data[start:end])
+
+
+class StubServer(object):
+	"""Serves files (name -> bytes) on 127.0.0.1 from a background thread, as a context manager
+
+	delay, in seconds, is added to every response; cut_after makes every
+	transfer break off at that offset of the file (see StubHandler)."""
+	def __init__(self, files, delay = 0, cut_after = None):
+		super(StubServer, self).__init__()
+		self.__server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+		self.__server.daemon_threads = True
+		self.__server.files = files
+		self.__server.delay = delay
+		self.__server.cut_after = cut_after
+		self.__server.connections = 0
+		self.__thread = Thread(target=self.__server.serve_forever, daemon=True)
+
+
+	@property
+	def connections(self):
+		"""Connections accepted so far"""
+		return self.__server.connections
+
+
+	def root(self):
+		return 'http://127.0.0.1:{}/download/'.format(self.__server.server_address[1])
+
+
+	def url(self, name):
+		return self.root() + name
+
+
+	def __enter__(self):
+		self.__thread.start()
+		return self
+
+
+	def __exit__(self, *exc):
+		self.__server.shutdown()
+		self.__server.server_close()
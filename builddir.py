@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+from os import statvfs, makedirs, symlink, readlink, remove, rename, getuid, access, listdir, lstat, walk, W_OK
+from os.path import join as path_join, islink, isdir, isfile, dirname, basename
+from shutil import rmtree, move
+from hashlib import sha1
+from threading import Thread, Event
+from subprocess import run as run_cmd
+from json import load as json_load, dump as json_dump
+
+from tracing import human_size
+
+
+TMPFS_PATH = '/dev/shm'
+
+
+def io_counters():
+	"""Bytes written by this process and the children it waited for: by write() calls, and to block devices"""
+	try:
+		with open('/proc/self/io', 'r') as f:
+			fields = dict(line.split(': ') for line in f.read().splitlines())
+		return int(fields['wchar']), int(fields['write_bytes'])
+	except (OSError, KeyError, ValueError):
+		return 0, 0
+
+
+def tree_size(path):
+	"""Space used by the files below path, in bytes"""
+	size = 0
+	for dirpath, dirnames, filenames in walk(path):
+		for name in dirnames + filenames:
+			size += lstat(path_join(dirpath, name)).st_blocks * 512
+
+	return size
+
+
+def relocate(src, dst):
+	"""Move the tree src to dst on another filesystem, keeping hard links, symlinks and modes"""
+	run_cmd(['cp', '-a', '--reflink=auto', src, dst + '.part']).check_returncode()
+	rename(dst + '.part', dst)
+	rmtree(src)
+
+
+class BuildDirectory(object):
+	"""Keeps src/ and the pkgdirs of a build on a RAM-backed filesystem, behind symlinks in the working directory
+
+	The trees live in <tmpfs>/makedebpkg-<uid>-<hash of the working directory>,
+	so the paths seen by the PKGBUILD stay the same and incremental builds find
+	them again. Usage of the filesystem is sampled in the background; once it
+	goes over budget, spill() moves the trees to the working directory, where
+	the rest of the build runs, and later builds start there. The .deb files
+	are written next to the symlinks, so only they, and the logs if asked,
+	end up in the working directory. Builds on disk release() the symlinks
+	an earlier build left behind."""
+	def __init__(self, rootpath, tmpfs = TMPFS_PATH, budget = 0, interval = 0.25):
+		super(BuildDirectory, self).__init__()
+		self.__rootpath = rootpath
+		self.__tmpfs = tmpfs
+		self.__budget = budget
+		self.__interval = interval
+		self.__names = []
+		self.__state_path = path_join(rootpath, '.builddir.json')
+		self.__stop = Event()
+		self.__sampler = None
+		self.__baseline = 0
+		self.__io = io_counters()
+		self.name = 'makedebpkg-{0}-{1}'.format(getuid(), sha1(rootpath.encode()).hexdigest()[:12])
+		self.root = path_join(tmpfs, self.name)
+		self.active = False
+		self.fresh = False
+		self.spilled = False
+		self.exceeded = False
+		self.peak = 0
+
+
+	def __used(self):
+		st = statvfs(self.__tmpfs)
+		return (st.f_blocks - st.f_bfree) * st.f_frsize
+
+
+	def __sample(self):
+		while not self.__stop.wait(self.__interval):
+			self.__record(self.__used() - self.__baseline)
+
+
+	def __record(self, usage):
+		self.peak = max(self.peak, usage)
+		if usage > self.__budget:
+			self.exceeded = True
+
+
+	def __previous_peak(self):
+		if not isfile(self.__state_path):
+			return 0
+
+		with open(self.__state_path, 'r') as f:
+			return json_load(f).get('peak', 0)
+
+
+	def place(self, names):
+		"""Put the trees called names, below the working directory, on tmpfs; False if they stay on disk"""
+		if not isdir(self.__tmpfs) or not access(self.__tmpfs, W_OK):
+			print('[ tmpfs ] {} is not a writable directory: building on disk'.format(self.__tmpfs))
+			self.release(names)
+			return False
+
+		st = statvfs(self.__tmpfs)
+		available = st.f_bavail * st.f_frsize
+		self.__budget = min(self.__budget or available // 2, available)
+
+		previous = self.__previous_peak()
+		if previous > self.__budget:
+			print('[ tmpfs ] the last build used {0}, over the budget of {1}: building on disk'.format(human_size(previous), human_size(self.__budget)))
+			self.release(names)
+			return False
+
+		makedirs(self.root, 0o700, exist_ok=True)
+		for name in names:
+			link = path_join(self.__rootpath, name)
+			target = path_join(self.root, name)
+
+			if islink(link) and readlink(link) == target:
+				if not isdir(target):
+					# tmpfs was emptied, e.g. by a reboot, and the previous results with it
+					makedirs(target)
+					self.fresh = True
+				continue
+
+			if islink(link):
+				remove(link)
+			if isdir(target):
+				rmtree(target)
+
+			if isdir(link):
+				print('[ tmpfs ] moving {0} to {1}'.format(name, self.root))
+				relocate(link, target)
+			else:
+				makedirs(target)
+
+			symlink(target, link)
+
+		self.__names = list(names)
+		self.active = True
+
+		# Trees kept from the last build count towards the budget, the rest of the filesystem does not
+		kept = tree_size(self.root)
+		self.__baseline = self.__used() - kept
+		self.__record(kept)
+		self.__sampler = Thread(target=self.__sample, daemon=True)
+		self.__sampler.start()
+		return True
+
+
+	def log_prefix(self, pkgdir):
+		"""Prefix of the build logs of pkgdir: on tmpfs as well, while the build is there"""
+		if not self.active:
+			return pkgdir
+
+		return path_join(self.root, pkgdir.rpartition('/')[2])
+
+
+	def check(self):
+		"""Spill to disk if the budget was exceeded since the build started; True if it did"""
+		if not self.active:
+			return False
+
+		self.__record(self.__used() - self.__baseline)
+		if self.exceeded:
+			self.spill()
+			return True
+
+		return False
+
+
+	def spill(self):
+		"""Move the trees back to the working directory, replacing their symlinks"""
+		print('[ tmpfs ] over the budget of {}: moving the build to disk'.format(human_size(self.__budget)))
+		self.__stop.set()
+		self.__sampler.join()
+
+		for name in self.__names:
+			self.__to_disk(name, path_join(self.root, name))
+
+		self.active = False
+		self.spilled = True
+
+
+	def __to_disk(self, name, target):
+		link = path_join(self.__rootpath, name)
+		relocate(target, link + '.spill')
+		remove(link)
+		rename(link + '.spill', link)
+
+
+	def release(self, names):
+		"""Bring the trees of names back from tmpfs, wherever it was, or drop their symlinks if tmpfs lost them"""
+		for name in names:
+			link = path_join(self.__rootpath, name)
+			if not islink(link) or basename(dirname(readlink(link))) != self.name:
+				continue
+
+			if isdir(readlink(link)):
+				print('[ tmpfs ] moving {} back to disk'.format(name))
+				self.__to_disk(name, readlink(link))
+			else:
+				print('[ tmpfs ] {} was lost with tmpfs'.format(name))
+				remove(link)
+
+
+	def finish(self, keep_logs = False):
+		"""Stop sampling, move the logs back if keep_logs, and report memory and I/O"""
+		if self.active:
+			self.__stop.set()
+			self.__sampler.join()
+			self.__record(self.__used() - self.__baseline)
+
+		if keep_logs and isdir(self.root):
+			for name in listdir(self.root):
+				if name.endswith('.log'):
+					move(path_join(self.root, name), path_join(self.__rootpath, name))
+
+		if self.__sampler:
+			with open(self.__state_path, 'w') as f:
+				json_dump({'peak': self.peak, 'budget': self.__budget, 'spilled': self.spilled}, f, indent=1)
+
+			print('[ tmpfs ] {0}: peak {1} of a {2} budget{3}'.format(self.root, human_size(self.peak), human_size(self.__budget), ', spilled to disk' if self.spilled else ''))
+
+		written, to_disk = (now - start for now, start in zip(io_counters(), self.__io))
+		print('[ I/O ] {0} written, {1} of it to disk'.format(human_size(written), human_size(to_disk)))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os.path import isfile
+from hashlib import sha256
+from json import load as json_load, dump as json_dump, dumps as json_dumps
+
+from fileutil import atomic_write
+
+
+class BuildState(object):
+	"""Fingerprints of the stages of the last successful build, used to skip unchanged work
+
+	A stage fingerprint covers its instructions and the fingerprint of the
+	stage before it, so a change anywhere upstream invalidates everything
+	downstream. A stage is forgotten as soon as it starts running and only
+	recorded again once it succeeds, so a failed stage always runs again."""
+	def __init__(self, path, force = False):
+		super(BuildState, self).__init__()
+		self.__path = path
+		self.__force = force
+		self.__stages = {}
+		self.report = []
+
+		if isfile(path):
+			with open(path, 'r') as f:
+				self.__stages = json_load(f)
+
+
+	@staticmethod
+	def fingerprint(*parts):
+		return sha256(json_dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+	def has_previous(self):
+		return bool(self.__stages) and not self.__force
+
+
+	def __save(self):
+		with atomic_write(self.__path) as f:
+			json_dump(self.__stages, f, indent=1)
+
+
+	def unchanged(self, stage, fingerprint):
+		return not self.__force and self.__stages.get(stage) == fingerprint
+
+
+	def should_run(self, stage, fingerprint, outputs_present = True):
+		"""Decide whether stage must run, recording the reason in the report"""
+		if self.__force:
+			reason = 'forced'
+		elif stage not in self.__stages:
+			reason = 'no previous build'
+		elif self.__stages[stage] != fingerprint:
+			reason = 'inputs changed'
+		elif not outputs_present:
+			reason = 'outputs missing'
+		else:
+			self.report.append((stage, 'skipped', 'unchanged'))
+			return False
+
+		self.report.append((stage, 'ran', reason))
+		if stage in self.__stages:
+			del self.__stages[stage]
+			self.__save()
+
+		return True
+
+
+	def note(self, stage, action, reason):
+		self.report.append((stage, action, reason))
+
+
+	def done(self, stage, fingerprint):
+		self.__stages[stage] = fingerprint
+		self.__save()
+
+
+	def print_report(self):
+		for stage, action, reason in self.report:
+			print('[ Incremental ] {0}: {1} ({2})'.format(stage, action, reason))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from hashlib import new as hash_new
+from mmap import mmap, ACCESS_READ
+from os import cpu_count
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# PKGBUILD array name -> hashlib algorithm
+ALGORITHMS = OrderedDict([
+	('md5sums', 'md5'),
+	('sha1sums', 'sha1'),
+	('sha224sums', 'sha224'),
+	('sha256sums', 'sha256'),
+	('sha384sums', 'sha384'),
+	('sha512sums', 'sha512'),
+	('b2sums', 'blake2b')
+])
+
+
+class ChecksumError(Exception):
+	def __init__(self, message = 'Checksum Error: source integrity check failed'):
+		super(ChecksumError, self).__init__(message)
+
+
+class MultiHash(object):
+	"""Feeds the same stream of bytes to several hash algorithms at once"""
+	def __init__(self, algorithms):
+		super(MultiHash, self).__init__()
+		self.__hashes = OrderedDict((a, hash_new(a)) for a in algorithms)
+
+
+	def update(self, data):
+		for h in self.__hashes.values():
+			h.update(data)
+
+
+	def hexdigests(self):
+		return OrderedDict((a, h.hexdigest()) for a, h in self.__hashes.items())
+
+
+def hash_file(path, algorithms):
+	"""Hash a file already on disk through a read-only memory map"""
+	h = MultiHash(algorithms)
+	with open(path, 'rb') as f:
+		# mmap cannot map empty files
+		if f.seek(0, 2):
+			with mmap(f.fileno(), 0, access=ACCESS_READ) as m:
+				h.update(m)
+
+	return h.hexdigests()
+
+
+def hash_files(paths, algorithms, jobs = None):
+	"""Hash many files in parallel; hashlib releases the GIL, so threads scale across cores"""
+	with ThreadPoolExecutor(max_workers=jobs or cpu_count()) as pool:
+		futures = OrderedDict((p, pool.submit(hash_file, p, algorithms)) for p in paths)
+		return OrderedDict((p, f.result()) for p, f in futures.items())
+
+
+def verify(filename, digests, expected):
+	"""Compare computed digests against the PKGBUILD values, honouring SKIP"""
+	for algorithm, value in expected.items():
+		if value.upper() == 'SKIP':
+			continue
+
+		if digests.get(algorithm) != value.lower():
+			raise ChecksumError('{0}: {1} mismatch (expected {2}, got {3})'.format(filename, algorithm, value, digests.get(algorithm)))
@@ -30,11 +30,19 @@
 # SUCH DAMAGE.
 
 
+from collections import OrderedDict
+
 from pkgdata import PkgData
 
 
 class ControlData(object):
 	"""Container for control file fields"""
+	__slots__ = (
+		'package', 'version', 'description', 'architecture', 'maintainer', 'essential',
+		'homepage', 'depends', 'recommends', 'conflicts', 'replaces', 'provides', 'bugs',
+		'installed_size', 'extra'
+	)
+
 	def __init__(self):
 		super(ControlData, self).__init__()
 		self.package = ''
@@ -50,6 +58,8 @@ class ControlData(object):
 		self.replaces = []
 		self.provides = []
 		self.bugs = '' # Currently not used
+		self.installed_size = 0 # In KiB
+		self.extra = OrderedDict() # Other fields, as found in a control file
 		# self.section = ''
 		# self.priority = ''
 		# self.origin = ''
@@ -85,27 +95,64 @@ class ControlData(object):
 		return self
 
 
+	def dumps(self):
+		"""Render the control file"""
+		lines = ['Package: {}'.format(self.package), 'Version: {}'.format(self.version)]
+		if self.description:
+			lines.append('Description: {}'.format(self.description))
+
+		lines.append('Architecture: {}'.format(' '.join(self.architecture)))
+		if self.installed_size:
+			lines.append('Installed-Size: {}'.format(self.installed_size))
+		if self.homepage:
+			lines.append('Homepage: {}'.format(self.homepage))
+		if self.depends:
+			lines.append('Depends: {}'.format(', '.join(self.depends)))
+		if self.recommends:
+			lines.append('Recommends: {}'.format(', '.join(self.recommends)))
+		if self.provides:
+			lines.append('Provides: {}'.format(', '.join(self.provides)))
+		if self.conflicts:
+			lines.append('Conflicts: {}'.format(', '.join(self.conflicts)))
+		if self.replaces:
+			lines.append('Replaces: {}'.format(', '.join(self.replaces)))
+
+		lines.append('Maintainer: {}'.format(self.maintainer))
+		lines.append('Essential: {}'.format('yes' if self.essential else 'no'))
+		lines.extend('{0}: {1}'.format(k, v) for k, v in self.extra.items())
+
+		return '\n'.join(lines) + '\n'
+
+
+	@classmethod
+	def loads(cls, text):
+		"""Read a control file, as rendered by dumps() or dpkg-deb"""
+		fields = OrderedDict()
+		name = None
+		for line in text.splitlines():
+			if line[:1] in (' ', '\t') and name:
+				fields[name] += '\n' + line
+			elif ':' in line:
+				name, value = line.split(':', 1)
+				fields[name] = value.strip()
+
+		con = cls()
+		con.package = fields.pop('Package', '')
+		con.version = fields.pop('Version', '')
+		con.description = fields.pop('Description', '')
+		con.architecture = fields.pop('Architecture', '').split()
+		con.maintainer = fields.pop('Maintainer', '')
+		con.essential = fields.pop('Essential', 'no') == 'yes'
+		con.homepage = fields.pop('Homepage', '')
+		con.installed_size = int(fields.pop('Installed-Size', 0) or 0)
+		for field in ('depends', 'recommends', 'provides', 'conflicts', 'replaces'):
+			value = fields.pop(field.capitalize(), '')
+			setattr(con, field, [v.strip() for v in value.split(',') if v.strip()])
+
+		con.extra = fields
+		return con
+
+
 	def export(self, filepath):
 		with open(filepath, 'w') as f:
-			f.write('Package: {}\n'.format(self.package))
-			f.write('Version: {}\n'.format(self.version))
-			if self.description:
-				f.write('Description: {}\n'.format(self.description))
-			
-			f.write('Architecture: {}\n'.format(' '.join(self.architecture)))
-			if self.homepage:
-				f.write('Homepage: {}\n'.format(self.homepage))
-			if self.depends:
-				f.write('Depends: {}\n'.format(', '.join(self.depends)))
-			if self.recommends:
-				f.write('Recommends: {}\n'.format(', '.join(self.recommends)))
-			if self.provides:
-				f.write('Provides: {}\n'.format(', '.join(self.provides)))
-			if self.conflicts:
-				f.write('Conflicts: {}\n'.format(', '.join(self.conflicts)))
-			if self.replaces:
-				f.write('Replaces: {}\n'.format(', '.join(self.replaces)))
-
-			f.write('Maintainer: {}\n'.format(self.maintainer))
-			f.write('Essential: {}'.format('yes' if self.essential else 'no'))
-			f.write('\n')
+			f.write(self.dumps())
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os import fork, pipe, dup2, close, read as os_read, chdir, environ, waitpid, remove, umask, getuid, devnull, WNOHANG, _exit
+from os.path import join as path_join, exists as path_exists
+from socket import socket, AF_UNIX, SOCK_STREAM
+from struct import Struct
+from json import loads as json_loads, dumps as json_dumps
+from threading import Thread
+from traceback import print_exc
+import sys
+
+
+# Frames sent to the client: b'o' and the length of output that follows, or b'x' and the exit status
+FRAME = Struct('<cI')
+CHUNK_SIZE = 1 << 16
+
+
+def default_socket_path():
+	runtime = environ.get('XDG_RUNTIME_DIR')
+	return path_join(runtime, 'makedebpkg.sock') if runtime else '/tmp/makedebpkg-{}.sock'.format(getuid())
+
+
+def recv_exactly(conn, size):
+	data = b''
+	while len(data) < size:
+		chunk = conn.recv(size - len(data))
+		if not chunk:
+			return None
+		data += chunk
+
+	return data
+
+
+class BuildDaemon(object):
+	"""Serves build jobs on a Unix socket, from a process that has already paid for its start-up
+
+	Each job is a forked copy of the daemon: modules are imported and the
+	parse cache is mapped once, and a job can chdir, exit or crash without
+	affecting the others. At most workers jobs run at once; further clients
+	wait in the listen backlog. build(arguments, parse_cache, on_exit) runs
+	one job, like makedebpkg.py would with these arguments.
+
+	HTTP connections are not kept warm across jobs: downloads run in the
+	forked job, whose connection pool goes away with it. Sharing one would
+	mean running the downloads of every job in the daemon itself."""
+	def __init__(self, socket_path, build, parse_cache = None, workers = 2):
+		super(BuildDaemon, self).__init__()
+		self.__socket_path = socket_path
+		self.__build = build
+		self.__parse_cache = parse_cache
+		self.__workers = max(1, workers)
+		self.__children = set()
+		self.__listener = None
+
+
+	def __reap(self, block):
+		while self.__children:
+			pid, status = waitpid(-1, 0 if block else WNOHANG)
+			if not pid:
+				return
+			self.__children.discard(pid)
+			block = False
+
+
+	def serve(self):
+		if path_exists(self.__socket_path):
+			remove(self.__socket_path)
+
+		# Only this user may submit jobs
+		old_umask = umask(0o077)
+		self.__listener = socket(AF_UNIX, SOCK_STREAM)
+		self.__listener.bind(self.__socket_path)
+		umask(old_umask)
+		self.__listener.listen(64)
+		print('[ Daemon ] listening on {0} with {1} worker(s)'.format(self.__socket_path, self.__workers))
+
+		try:
+			while True:
+				if len(self.__children) >= self.__workers:
+					self.__reap(True)
+				self.__reap(False)
+
+				conn, address = self.__listener.accept()
+				try:
+					conn.settimeout(10)
+					request = json_loads(conn.makefile('rb').readline().decode())
+					conn.settimeout(None)
+				except (OSError, ValueError) as e:
+					print('[ Daemon ] bad request: {}'.format(e), file=sys.stderr)
+					conn.close()
+					continue
+
+				if self.__parse_cache:
+					self.__parse_cache.refresh()
+
+				print('[ Daemon ] {0}: {1}'.format(request.get('cwd'), ' '.join(request.get('argv', []))))
+				sys.stdout.flush()
+				sys.stderr.flush()
+				pid = fork()
+				if pid == 0:
+					self.__child(conn, request)
+
+				self.__children.add(pid)
+				conn.close()
+
+		except KeyboardInterrupt:
+			pass
+
+		finally:
+			self.__listener.close()
+			if path_exists(self.__socket_path):
+				remove(self.__socket_path)
+
+
+	@staticmethod
+	def __relay(fd, conn):
+		"""Send what the job prints to the client; keep draining if the client went away"""
+		connected = True
+		while True:
+			data = os_read(fd, CHUNK_SIZE)
+			if not data:
+				break
+
+			if connected:
+				try:
+					conn.sendall(FRAME.pack(b'o', len(data)) + data)
+				except OSError:
+					connected = False
+
+		close(fd)
+
+
+	def __child(self, conn, request):
+		"""Run one job in the forked process, and never return"""
+		code = 1
+		try:
+			self.__listener.close()
+			r, w = pipe()
+			relay = Thread(target=self.__relay, args=(r, conn))
+			relay.start()
+
+			# The job and everything it spawns print to the pipe
+			dup2(w, 1)
+			dup2(w, 2)
+			close(w)
+
+			handlers = []
+			try:
+				environ.clear()
+				environ.update(request['env'])
+				chdir(request['cwd'])
+				self.__build(request['argv'], self.__parse_cache, handlers.append)
+				code = 0
+			except SystemExit as e:
+				if isinstance(e.code, int) or e.code is None:
+					code = e.code or 0
+				else:
+					print(e.code, file=sys.stderr)
+			except BaseException:
+				print_exc()
+
+			for handler in reversed(handlers):
+				try:
+					handler()
+				except Exception:
+					print_exc()
+
+			sys.stdout.flush()
+			sys.stderr.flush()
+			with open(devnull, 'w') as null:
+				dup2(null.fileno(), 1)
+				dup2(null.fileno(), 2)
+
+			relay.join()
+			conn.sendall(FRAME.pack(b'x', code & 0xff))
+		except BaseException:
+			pass
+		finally:
+			_exit(0)
+
+
+def submit(socket_path, arguments, cwd, env):
+	"""Run a job on the daemon, copying its output to stdout, and return its exit status"""
+	conn = socket(AF_UNIX, SOCK_STREAM)
+	conn.connect(socket_path)
+	conn.sendall(json_dumps({'argv': arguments, 'cwd': cwd, 'env': dict(env)}).encode() + b'\n')
+
+	out = sys.stdout.buffer
+	while True:
+		header = recv_exactly(conn, FRAME.size)
+		if header is None:
+			print('[ Daemon ] connection lost before the job finished', file=sys.stderr)
+			return 1
+
+		kind, value = FRAME.unpack(header)
+		if kind == b'x':
+			return value
+
+		data = recv_exactly(conn, value)
+		if data is None:
+			print('[ Daemon ] connection lost before the job finished', file=sys.stderr)
+			return 1
+
+		out.write(data)
+		out.flush()
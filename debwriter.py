@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os import listdir, environ, cpu_count, replace, remove
+from os.path import isdir, islink, isfile, join as path_join
+from tarfile import open as tar_open, TarInfo, GNU_FORMAT, REGTYPE, DIRTYPE, SYMTYPE, LNKTYPE
+from stat import S_IMODE
+from subprocess import Popen, PIPE
+from shutil import which
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from time import time
+import gzip
+import lzma
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+from control import ControlData
+
+
+# Compression -> member suffix
+COMPRESSIONS = {'xz': '.xz', 'zstd': '.zst', 'gzip': '.gz', 'none': ''}
+
+# Same defaults as dpkg-deb
+DEFAULT_LEVELS = {'xz': 6, 'zstd': 3, 'gzip': 9, 'none': 0}
+
+
+class DebError(Exception):
+	def __init__(self, message = 'Deb Error: cannot build package'):
+		super(DebError, self).__init__(message)
+
+
+class ParallelGzip(object):
+	"""Compresses fixed-size chunks on a thread pool, writing them in order as concatenated gzip members"""
+	def __init__(self, fileobj, level, threads, chunk = 1 << 20):
+		super(ParallelGzip, self).__init__()
+		self.__fileobj = fileobj
+		self.__level = level
+		self.__threads = threads
+		self.__chunk = chunk
+		self.__buffer = bytearray()
+		self.__pending = deque()
+		self.__pool = ThreadPoolExecutor(max_workers=threads)
+
+
+	def __submit(self, data):
+		self.__pending.append(self.__pool.submit(gzip.compress, data, self.__level, mtime=0))
+		# Keep a bounded number of chunks in flight
+		while len(self.__pending) > 2 * self.__threads:
+			self.__fileobj.write(self.__pending.popleft().result())
+
+
+	def write(self, data):
+		self.__buffer += data
+		while len(self.__buffer) >= self.__chunk:
+			self.__submit(bytes(self.__buffer[:self.__chunk]))
+			del self.__buffer[:self.__chunk]
+
+		return len(data)
+
+
+	def close(self):
+		if self.__buffer or not self.__pending:
+			self.__submit(bytes(self.__buffer))
+			self.__buffer = bytearray()
+
+		while self.__pending:
+			self.__fileobj.write(self.__pending.popleft().result())
+
+		self.__pool.shutdown()
+
+
+class PipeCompressor(object):
+	"""Compresses through an external command that writes straight into fileobj"""
+	def __init__(self, fileobj, argv):
+		super(PipeCompressor, self).__init__()
+		self.__fileobj = fileobj
+		self.__fileobj.flush()
+		self.__proc = Popen(argv, stdin=PIPE, stdout=fileobj.fileno())
+
+
+	def write(self, data):
+		self.__proc.stdin.write(data)
+		return len(data)
+
+
+	def close(self):
+		self.__proc.stdin.close()
+		if self.__proc.wait():
+			raise DebError('{0} exited with status {1}'.format(self.__proc.args[0], self.__proc.returncode))
+
+		# The child moved the shared file offset behind our back
+		self.__fileobj.seek(0, 2)
+
+
+class ModuleCompressor(object):
+	"""Adapts a compressobj-style object to the write()/close() interface"""
+	def __init__(self, fileobj, compressor):
+		super(ModuleCompressor, self).__init__()
+		self.__fileobj = fileobj
+		self.__compressor = compressor
+
+
+	def write(self, data):
+		self.__fileobj.write(self.__compressor.compress(data))
+		return len(data)
+
+
+	def close(self):
+		self.__fileobj.write(self.__compressor.flush())
+
+
+class DebWriter(object):
+	"""Assembles a binary package from a pkgdir tree without dpkg-deb
+
+	The package is an ar archive holding debian-binary, control.tar and
+	data.tar, the same layout dpkg-deb produces. Every entry is owned by
+	root:root, so no fakeroot is needed."""
+	def __init__(self, compression = 'xz', level = None, threads = None):
+		super(DebWriter, self).__init__()
+		if compression not in COMPRESSIONS:
+			raise DebError('unknown compression: {}'.format(compression))
+
+		self.__compression = compression
+		self.__level = DEFAULT_LEVELS[compression] if level is None else level
+		self.__threads = threads or cpu_count()
+		self.__epoch = int(environ['SOURCE_DATE_EPOCH']) if environ.get('SOURCE_DATE_EPOCH') else None
+
+
+	def __compressor(self, fileobj, threads):
+		if self.__compression == 'gzip':
+			if threads > 1:
+				return ParallelGzip(fileobj, self.__level, threads)
+
+			return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=self.__level, mtime=0)
+
+		elif self.__compression == 'xz':
+			if which('xz'):
+				return PipeCompressor(fileobj, ['xz', '-T{}'.format(threads), '-{}'.format(self.__level), '-c'])
+
+			return ModuleCompressor(fileobj, lzma.LZMACompressor(preset=self.__level))
+
+		elif self.__compression == 'zstd':
+			if zstandard:
+				return zstandard.ZstdCompressor(level=self.__level, threads=threads).stream_writer(fileobj, closefd=False)
+
+			if which('zstd'):
+				return PipeCompressor(fileobj, ['zstd', '-q', '-T{}'.format(threads), '-{}'.format(self.__level), '-c'])
+
+			raise DebError('zstd compression needs the zstandard module or the zstd command')
+
+		return fileobj
+
+
+	@staticmethod
+	def __ar_header(name, size, mtime):
+		return '{0:<16}{1:<12}{2:<6}{3:<6}{4:<8}{5:<10}`\n'.format(name, mtime, 0, 0, 100644, size).encode()
+
+
+	def __ar_member(self, f, name, fill, threads = 1):
+		"""Write an ar member whose content is produced by fill(fileobj), patching its size in afterwards"""
+		mtime = self.__epoch if self.__epoch is not None else int(time())
+		header_pos = f.tell()
+		f.write(self.__ar_header(name, 0, mtime))
+		start = f.tell()
+
+		w = self.__compressor(f, threads) if name != 'debian-binary' else f
+		fill(w)
+		if w is not f:
+			w.close()
+
+		end = f.seek(0, 2)
+		if (end - start) % 2:
+			f.write(b'\n')
+
+		f.seek(header_pos)
+		f.write(self.__ar_header(name, end - start, mtime))
+		f.seek(0, 2)
+
+
+	def __normalise(self, info):
+		info.uid = info.gid = 0
+		info.uname = info.gname = 'root'
+		if self.__epoch is not None and info.mtime > self.__epoch:
+			info.mtime = self.__epoch
+
+		return info
+
+
+	def __add_tree(self, tar_file, path, arcname, exclude = ()):
+		info = self.__normalise(tar_file.gettarinfo(path, arcname))
+
+		if info.isreg():
+			with open(path, 'rb') as f:
+				tar_file.addfile(info, f)
+		else:
+			tar_file.addfile(info)
+
+		if isdir(path) and not islink(path):
+			for name in sorted(listdir(path)):
+				if name not in exclude:
+					self.__add_tree(tar_file, path_join(path, name), arcname + '/' + name)
+
+
+	def __write_control(self, fileobj, pkgdir, control):
+		debdir = path_join(pkgdir, 'DEBIAN')
+		with tar_open(fileobj=fileobj, mode='w|', format=GNU_FORMAT) as tar_file:
+			if isdir(debdir):
+				self.__add_tree(tar_file, debdir, '.', ('control',) if control else ())
+			else:
+				tar_file.addfile(self.__normalise(tar_file.gettarinfo(pkgdir, '.')))
+
+			if control:
+				data = control.dumps().encode()
+				info = self.__normalise(TarInfo('./control'))
+				info.type = REGTYPE
+				info.size = len(data)
+				info.mode = 0o644
+				info.mtime = self.__epoch if self.__epoch is not None else int(time())
+				tar_file.addfile(info, BytesIO(data))
+
+
+	def __write_data(self, fileobj, pkgdir, scan = None):
+		with tar_open(fileobj=fileobj, mode='w|', format=GNU_FORMAT) as tar_file:
+			if scan is None:
+				self.__add_tree(tar_file, pkgdir, '.', ('DEBIAN',))
+				return
+
+			# The tree was already walked: build the headers from the scan instead of stat()ing again
+			links = {}
+			for entry in scan.entries.values():
+				path = pkgdir + entry.path[1:]
+				st = entry.stat
+				info = TarInfo(entry.path)
+				info.mode = S_IMODE(st.st_mode)
+				info.mtime = int(st.st_mtime)
+
+				if entry.kind == 'f' and st.st_nlink > 1 and (st.st_dev, st.st_ino) in links:
+					info.type = LNKTYPE
+					info.linkname = links[(st.st_dev, st.st_ino)]
+				elif entry.kind == 'f':
+					info.type = REGTYPE
+					info.size = st.st_size
+					links[(st.st_dev, st.st_ino)] = entry.path
+				elif entry.kind == 'd':
+					info.type = DIRTYPE
+				elif entry.kind == 'l':
+					info.type = SYMTYPE
+					info.linkname = entry.target
+				else:
+					info = tar_file.gettarinfo(path, entry.path)
+
+				self.__normalise(info)
+				if info.type == REGTYPE:
+					with open(path, 'rb') as f:
+						tar_file.addfile(info, f)
+				else:
+					tar_file.addfile(info)
+
+
+	def write(self, pkgdir, output, control = None, scan = None):
+		"""Build output from pkgdir; control, if given, replaces DEBIAN/control
+
+		scan, a PkgScan of pkgdir, saves walking the tree a second time."""
+		if control is not None and not isinstance(control, ControlData):
+			raise TypeError("Invalid type for control.")
+
+		if not control and not isfile(path_join(pkgdir, 'DEBIAN', 'control')):
+			raise DebError('{}: missing DEBIAN/control'.format(pkgdir))
+
+		suffix = COMPRESSIONS[self.__compression]
+		part_path = output + '.part'
+
+		try:
+			with open(part_path, 'wb') as f:
+				f.write(b'!<arch>\n')
+				self.__ar_member(f, 'debian-binary', lambda w: w.write(b'2.0\n'))
+				self.__ar_member(f, 'control.tar' + suffix, lambda w: self.__write_control(w, pkgdir, control))
+				self.__ar_member(f, 'data.tar' + suffix, lambda w: self.__write_data(w, pkgdir, scan), self.__threads)
+
+		except:
+			if isfile(part_path):
+				remove(part_path)
+			raise
+
+		replace(part_path, output)
+
+		return output
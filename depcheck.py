@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import re
+
+
+STATUS_PATH = '/var/lib/dpkg/status'
+
+# name, then an optional Debian '(op version)' or PKGBUILD 'opversion' constraint
+DEPENDENCY = re.compile(r'\s*([^\s(<>=]+)\s*(?:\(\s*(<<|>>|<=|>=|=|<|>)\s*([^)\s]+)\s*\)|(<=|>=|=|<|>)\s*(\S+))?\s*$')
+# PKGBUILDs write < and > for strict comparisons, as Debian did before << and >>
+OPERATORS = {
+	'<<': lambda c: c < 0, '<': lambda c: c < 0,
+	'<=': lambda c: c <= 0,
+	'=': lambda c: c == 0,
+	'>=': lambda c: c >= 0,
+	'>>': lambda c: c > 0, '>': lambda c: c > 0
+}
+VERSION_PART = re.compile(r'(\D*)(\d*)')
+
+
+class DependencyError(Exception):
+	def __init__(self, message = 'Dependency Error: invalid dependency'):
+		super(DependencyError, self).__init__(message)
+
+
+def order(c):
+	"""Sort weight of a character in the non-digit part of a Debian version"""
+	if c == '~':
+		return -1
+	if c.isalpha():
+		return ord(c)
+
+	return ord(c) + 256
+
+
+def compare_fragment(a, b):
+	"""dpkg's verrevcmp(): compare alternating non-digit and digit parts"""
+	parts_a = VERSION_PART.findall(a)
+	parts_b = VERSION_PART.findall(b)
+	for i in range(max(len(parts_a), len(parts_b))):
+		text_a, num_a = parts_a[i] if i < len(parts_a) else ('', '')
+		text_b, num_b = parts_b[i] if i < len(parts_b) else ('', '')
+
+		for j in range(max(len(text_a), len(text_b))):
+			ca = order(text_a[j]) if j < len(text_a) else 0
+			cb = order(text_b[j]) if j < len(text_b) else 0
+			if ca != cb:
+				return -1 if ca < cb else 1
+
+		if int(num_a or 0) != int(num_b or 0):
+			return -1 if int(num_a or 0) < int(num_b or 0) else 1
+
+	return 0
+
+
+def split_version(version):
+	epoch, sep, rest = version.rpartition(':') if ':' in version else ('0', '', version)
+	upstream, sep, revision = rest.rpartition('-') if '-' in rest else (rest, '', '0')
+	return int(epoch or 0), upstream, revision
+
+
+def compare_versions(a, b):
+	"""Compare two Debian versions like dpkg --compare-versions, returning -1, 0 or 1"""
+	epoch_a, upstream_a, revision_a = split_version(a)
+	epoch_b, upstream_b, revision_b = split_version(b)
+	if epoch_a != epoch_b:
+		return -1 if epoch_a < epoch_b else 1
+
+	return compare_fragment(upstream_a, upstream_b) or compare_fragment(revision_a, revision_b)
+
+
+def parse_dependency(dep):
+	"""Alternatives of a depends entry, as (name, operator, version) tuples"""
+	alternatives = []
+	for alternative in dep.split('|'):
+		m = DEPENDENCY.match(alternative)
+		if not m:
+			raise DependencyError('invalid dependency: {}'.format(dep))
+
+		name, op, version = m.group(1), m.group(2) or m.group(4), m.group(3) or m.group(5)
+		# Multi-Arch qualifiers, like python3:any
+		alternatives.append((name.split(':')[0], op, version))
+
+	return alternatives
+
+
+class DpkgStatus(object):
+	"""Installed packages from the dpkg status file, indexed by name and by what they provide"""
+	def __init__(self, path = STATUS_PATH, assume_installed = ()):
+		super(DpkgStatus, self).__init__()
+		# name -> versions of the installed packages, or of None for unversioned provides
+		self.packages = {}
+		self.provides = {}
+		# Names satisfying any constraint, like packages built earlier in a batch
+		self.assumed = set(assume_installed)
+
+		with open(path, 'r', encoding='utf-8', errors='replace') as f:
+			text = f.read()
+
+		for paragraph in text.split('\n\n'):
+			fields = {}
+			for line in paragraph.split('\n'):
+				if line[:1] not in (' ', '\t', '') and ':' in line:
+					name, value = line.split(':', 1)
+					fields[name] = value.strip()
+
+			if 'Package' not in fields or not fields.get('Status', '').endswith(' installed'):
+				continue
+
+			self.packages.setdefault(fields['Package'], []).append(fields.get('Version', ''))
+			for provided in fields.get('Provides', '').split(','):
+				if not provided.strip():
+					continue
+
+				name, op, version = parse_dependency(provided)[0]
+				self.provides.setdefault(name, []).append(version if op == '=' else None)
+
+
+	def satisfies(self, name, op = None, version = None):
+		"""True if an installed package, or something it provides, matches the constraint"""
+		if name in self.assumed:
+			return True
+
+		if not op:
+			return name in self.packages or name in self.provides
+
+		check = OPERATORS[op]
+		candidates = self.packages.get(name, []) + [v for v in self.provides.get(name, []) if v is not None]
+		return any(check(compare_versions(v, version)) for v in candidates)
+
+
+	def missing(self, deps):
+		"""Entries of deps satisfied by none of their alternatives"""
+		return [dep for dep in deps if not any(self.satisfies(*a) for a in parse_dependency(dep))]
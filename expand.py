@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from fnmatch import fnmatchcase
+import re
+
+
+# One pass over a string: escapes, quotes, ${...} and $name
+TOKEN = re.compile(r"""\\.|'|"|\$\{((?:[^{}]|\{[^{}]*\})*)\}|\$([A-Za-z_][A-Za-z0-9_]*)""", re.S)
+
+# Inside braces: optional length operator, name, optional subscript, then the operator
+PARAMETER = re.compile(r'(#)?([A-Za-z_][A-Za-z0-9_]*)(?:\[([^\]]*)\])?(.*)$', re.S)
+SUBSTRING = re.compile(r':[ \t]*(-?\d+)(?::[ \t]*(-?\d+))?$')
+
+
+def remove_prefix(value, pattern, longest):
+	sizes = range(len(value), -1, -1) if longest else range(len(value) + 1)
+	for i in sizes:
+		if fnmatchcase(value[:i], pattern):
+			return value[i:]
+
+	return value
+
+
+def remove_suffix(value, pattern, longest):
+	starts = range(len(value) + 1) if longest else range(len(value), -1, -1)
+	for i in starts:
+		if fnmatchcase(value[i:], pattern):
+			return value[:i]
+
+	return value
+
+
+def substitute(value, pattern, replacement, every = False, anchor = ''):
+	"""${name/pattern/replacement} and its //, /# and /% variants, with glob patterns"""
+	if anchor == '#':
+		for i in range(len(value), -1, -1):
+			if fnmatchcase(value[:i], pattern):
+				return replacement + value[i:]
+		return value
+
+	if anchor == '%':
+		for i in range(len(value) + 1):
+			if fnmatchcase(value[i:], pattern):
+				return value[:i] + replacement
+		return value
+
+	result = ''
+	i = 0
+	while i <= len(value):
+		# Longest match starting at i
+		for j in range(len(value), i - 1, -1):
+			if j > i and fnmatchcase(value[i:j], pattern):
+				result += replacement
+				i = j
+				break
+		else:
+			if i < len(value):
+				result += value[i]
+			i += 1
+			continue
+
+		if not every:
+			return result + value[i:]
+
+	return result
+
+
+class Expander(object):
+	"""Expands shell parameters, like ${pkgver} or ${source[0]%.tar.gz}, in a single pass
+
+	variables maps names to strings or lists (arrays). Values may refer to
+	other variables and are resolved on first use. Parameters that are not
+	defined are left untouched, for the shell to deal with."""
+	def __init__(self, variables):
+		super(Expander, self).__init__()
+		self.__variables = variables
+		self.__resolved = {}
+		self.__resolving = set()
+
+
+	def lookup(self, name):
+		"""Resolved value of name, as a list of words, or None if it is not defined"""
+		if name in self.__resolved:
+			return self.__resolved[name]
+
+		value = self.__variables.get(name)
+		if value is None or name in self.__resolving:
+			return None
+
+		self.__resolving.add(name)
+		if isinstance(value, (list, tuple)):
+			words = [self.expand(str(v), False) for v in value]
+		else:
+			words = [self.expand(str(value), False)]
+		self.__resolving.discard(name)
+
+		self.__resolved[name] = words
+		return words
+
+
+	def __operate(self, value, op):
+		"""Apply a parameter operator to one value, or return None if it is not supported"""
+		if not op:
+			return value
+
+		if op.startswith(('%%', '##')):
+			pattern = self.expand(op[2:], False)
+			return remove_suffix(value, pattern, True) if op[0] == '%' else remove_prefix(value, pattern, True)
+
+		if op[0] in '%#':
+			pattern = self.expand(op[1:], False)
+			return remove_suffix(value, pattern, False) if op[0] == '%' else remove_prefix(value, pattern, False)
+
+		if op[0] == '/':
+			every = op.startswith('//')
+			body = op[2:] if every else op[1:]
+			anchor = ''
+			if not every and body[:1] in ('#', '%'):
+				anchor, body = body[0], body[1:]
+
+			pattern, sep, replacement = body.partition('/')
+			return substitute(value, self.expand(pattern, False), self.expand(replacement, False), every, anchor)
+
+		if op in ('^^', ',,'):
+			return value.upper() if op == '^^' else value.lower()
+
+		if op in ('^', ','):
+			return (value[:1].upper() if op == '^' else value[:1].lower()) + value[1:]
+
+		m = SUBSTRING.match(op)
+		if m:
+			start = int(m.group(1))
+			if m.group(2) is None:
+				return value[start:]
+
+			length = int(m.group(2))
+			end = start + length if length >= 0 else length
+			return value[start:end] if end else value[start:]
+
+		return None
+
+
+	def __parameter(self, braced):
+		"""Expansion of the content of ${...}, or None to leave it untouched"""
+		m = PARAMETER.match(braced)
+		if not m:
+			return None
+
+		length, name, subscript, op = m.groups()
+		words = self.lookup(name)
+
+		# Defaults and alternatives also apply to unset parameters
+		if op[:2] in (':-', ':+', ':=') or op[:1] in ('-', '+', '='):
+			colon = op.startswith(':')
+			kind, word = (op[1], op[2:]) if colon else (op[0], op[1:])
+			is_set = words is not None and (not colon or any(words))
+
+			if kind == '+':
+				return self.expand(word, False) if is_set else ''
+
+			if is_set:
+				op = ''
+			else:
+				return self.expand(word, False)
+
+		if words is None:
+			return None
+
+		if subscript in ('@', '*'):
+			selected = words
+		elif subscript is not None:
+			try:
+				selected = [words[int(subscript)]]
+			except (ValueError, IndexError):
+				selected = ['']
+		else:
+			selected = words[:1] or ['']
+
+		if length:
+			return str(len(words) if subscript in ('@', '*') else len(selected[0]))
+
+		results = [self.__operate(v, op) for v in selected]
+		if None in results:
+			return None
+
+		return ' '.join(results)
+
+
+	def expand(self, s, shell = True):
+		"""Expand every known parameter in s
+
+		With shell set, s is a line of shell code: nothing is expanded inside
+		single quotes, as bash would do."""
+		quoted = {'\'': False, '"': False}
+
+		def replace(m):
+			token = m.group(0)
+
+			if token in quoted:
+				other = '"' if token == '\'' else '\''
+				if shell and not quoted[other]:
+					quoted[token] = not quoted[token]
+				return token
+
+			if token[0] == '\\':
+				# Backslashes are literal inside single quotes, so \' still closes them
+				if quoted['\''] and token[1] == '\'':
+					quoted['\''] = False
+				return token
+
+			if quoted['\'']:
+				return token
+
+			if m.group(2) is not None:
+				words = self.lookup(m.group(2))
+				return words[0] if words else (token if words is None else '')
+
+			value = self.__parameter(m.group(1))
+			return token if value is None else value
+
+		return TOKEN.sub(replace, s)
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os import makedirs, lstat, readlink, symlink, chmod, remove, cpu_count
+from os.path import basename, dirname, isfile, lexists, normpath, join as path_join
+from stat import S_ISDIR, S_ISLNK, S_IMODE
+from json import load as json_load, dump as json_dump
+from tarfile import open as tar_open
+from zipfile import ZipFile
+from subprocess import Popen, run as run_cmd, PIPE
+from shutil import which, copyfileobj
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import bz2
+import lzma
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+
+# (offset, magic bytes, format)
+MAGIC = [
+	(0, b'\x1f\x8b', 'gz'),
+	(0, b'BZh', 'bz2'),
+	(0, b'\xfd7zXZ\x00', 'xz'),
+	(0, b'\x28\xb5\x2f\xfd', 'zst'),
+	(0, b'PK\x03\x04', 'zip'),
+	(0, b'PK\x05\x06', 'zip'),
+	(0, b'7z\xbc\xaf\x27\x1c', '7z'),
+	(0, b'Rar!\x1a\x07', 'rar'),
+	(257, b'ustar', 'tar')
+]
+
+# Bytes needed to recognise every format in MAGIC
+HEADER_SIZE = 512
+
+# Formats that can be extracted while they are being read
+STREAM_FORMATS = ('tar', 'gz', 'bz2', 'xz', 'zst')
+
+# Suffixes dropped from compressed files that turn out not to be tarballs
+SUFFIXES = {'gz': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zst': '.zst'}
+
+
+class ExtractError(Exception):
+	def __init__(self, message = 'Extract Error: unsupported archive'):
+		super(ExtractError, self).__init__(message)
+
+
+def detect_format(header):
+	"""Recognise an archive or compression format from its first bytes"""
+	for offset, magic, fmt in MAGIC:
+		if header[offset:offset + len(magic)] == magic:
+			return fmt
+
+	return None
+
+
+def read_header(fileobj, size = HEADER_SIZE):
+	"""Read up to size bytes, even from streams returning short reads"""
+	header = b''
+	while len(header) < size:
+		data = fileobj.read(size - len(header))
+		if not data:
+			break
+
+		header += data
+
+	return header
+
+
+class PrefixedStream(object):
+	"""Read-only file object replaying bytes already consumed from stream"""
+	def __init__(self, prefix, stream):
+		super(PrefixedStream, self).__init__()
+		self.__prefix = prefix
+		self.__stream = stream
+
+
+	def read(self, size = -1):
+		if not self.__prefix:
+			return self.__stream.read(size)
+
+		if size is None or size < 0:
+			data, self.__prefix = self.__prefix + self.__stream.read(), b''
+			return data
+
+		data, self.__prefix = self.__prefix[:size], self.__prefix[size:]
+		return data
+
+
+class ZstdPipe(object):
+	"""Decompress a zstd stream through the zstd command, for hosts without the zstandard module"""
+	def __init__(self, fileobj):
+		super(ZstdPipe, self).__init__()
+		if not which('zstd'):
+			raise ExtractError('zstd archives need the zstandard module or the zstd command')
+
+		self.__proc = Popen(['zstd', '-dcq'], stdin=PIPE, stdout=PIPE)
+		self.__feeder = Thread(target=self.__feed, args=(fileobj,), daemon=True)
+		self.__feeder.start()
+
+
+	def __feed(self, fileobj):
+		try:
+			copyfileobj(fileobj, self.__proc.stdin, 1 << 20)
+		finally:
+			self.__proc.stdin.close()
+
+
+	def read(self, size = -1):
+		return self.__proc.stdout.read(size)
+
+
+	def close(self):
+		self.__proc.stdout.close()
+		self.__feeder.join()
+		if self.__proc.wait():
+			raise ExtractError('zstd exited with status {}'.format(self.__proc.returncode))
+
+
+def decompress(fileobj, fmt):
+	"""Wrap fileobj into a streaming decompressor for fmt"""
+	if fmt == 'gz':
+		return gzip.GzipFile(fileobj=fileobj, mode='rb')
+	elif fmt == 'bz2':
+		return bz2.BZ2File(fileobj, 'rb')
+	elif fmt == 'xz':
+		return lzma.LZMAFile(fileobj, 'rb')
+	elif fmt == 'zst':
+		if zstandard:
+			return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+		return ZstdPipe(fileobj)
+
+	return fileobj
+
+
+class Extractor(object):
+	"""Extracts sources into a directory, remembering what each archive produced
+
+	A manifest of every extracted tree is kept in destdir/.manifests, so that
+	extracting an unchanged archive again only rewrites the members that were
+	modified or removed since, and nothing at all if the tree is intact."""
+	def __init__(self, destdir, jobs = None):
+		super(Extractor, self).__init__()
+		self.__destdir = destdir
+		self.__jobs = jobs or cpu_count()
+		self.__manifests = path_join(destdir, '.manifests')
+
+
+	@staticmethod
+	def member_name(name):
+		name = normpath(name)
+		return '' if name == '.' else name
+
+
+	def __state(self, name):
+		"""Type, size and mtime of an extracted entry, as recorded in manifests"""
+		try:
+			st = lstat(path_join(self.__destdir, name))
+		except OSError:
+			return None
+
+		if S_ISDIR(st.st_mode):
+			return ['d']
+		elif S_ISLNK(st.st_mode):
+			return ['l', readlink(path_join(self.__destdir, name))]
+
+		return ['f', st.st_size, st.st_mtime_ns]
+
+
+	@staticmethod
+	def archive_key(path):
+		st = lstat(path)
+		return [st.st_size, st.st_mtime_ns]
+
+
+	def __load_manifest(self, name):
+		path = path_join(self.__manifests, name + '.json')
+		if not isfile(path):
+			return None
+
+		with open(path, 'r') as f:
+			return json_load(f)
+
+
+	def record(self, archive_path, names):
+		"""Write the manifest of the tree extracted from archive_path"""
+		makedirs(self.__manifests, 0o755, exist_ok=True)
+		names = [n for n in (self.member_name(n) for n in names) if n]
+
+		with open(path_join(self.__manifests, basename(archive_path) + '.json'), 'w') as f:
+			json_dump({
+				'archive': self.archive_key(archive_path),
+				'entries': {n: self.__state(n) for n in names}
+			}, f)
+
+
+	def extract(self, archive_path):
+		"""Extract an archive found on disk, returning False if the extracted tree was already up to date"""
+		name = basename(archive_path)
+		manifest = self.__load_manifest(name)
+		only = None
+
+		if manifest and manifest['archive'] == self.archive_key(archive_path):
+			only = set(n for n, st in manifest['entries'].items() if self.__state(n) != st)
+			if not only:
+				print('[ Extract ] {}: up to date'.format(name))
+				return False
+
+		with open(archive_path, 'rb') as f:
+			fmt = detect_format(read_header(f))
+
+		if fmt == 'rar':
+			raise ExtractError('{}: .rar is currently unsupported'.format(name))
+
+		elif fmt not in STREAM_FORMATS + ('zip', '7z'):
+			raise ExtractError('{}: unknown archive format'.format(name))
+
+		print('[ Extract ] {0}: {1}{2}'.format(name, fmt, ' ({} members changed)'.format(len(only)) if only else ''))
+
+		if fmt == 'zip':
+			names = self.__extract_zip(archive_path, only)
+
+		elif fmt == '7z':
+			names = self.__extract_7z(archive_path)
+
+		else:
+			with open(archive_path, 'rb') as f:
+				names = self.extract_stream(f, name, self.__destdir, only)
+
+		self.record(archive_path, manifest['entries'] if only else names)
+
+		return True
+
+
+	@classmethod
+	def extract_stream(cls, fileobj, name, destdir, only = None):
+		"""Extract a tarball or compressed file while reading it, returning the member names"""
+		header = read_header(fileobj)
+		fmt = detect_format(header)
+
+		if fmt not in STREAM_FORMATS:
+			raise ExtractError('{}: cannot be extracted as a stream'.format(name))
+
+		decompressed = decompress(PrefixedStream(header, fileobj), fmt)
+		stream = decompressed
+
+		try:
+			if fmt != 'tar':
+				header = read_header(decompressed)
+				stream = PrefixedStream(header, decompressed)
+
+				if detect_format(header) != 'tar':
+					# A single compressed file, e.g. foo.gz: decompress it next to the archive
+					target = name[:-len(SUFFIXES[fmt])] if name.endswith(SUFFIXES[fmt]) else name + '.out'
+					with open(path_join(destdir, target), 'wb') as f:
+						copyfileobj(stream, f, 1 << 20)
+
+					return [target]
+
+			names = []
+			with tar_open(fileobj=stream, mode='r|') as tar_file:
+				for member in tar_file:
+					names.append(member.name)
+					if only is None or cls.member_name(member.name) in only:
+						tar_file.extract(member, destdir)
+
+			return names
+
+		finally:
+			if decompressed is not fileobj and hasattr(decompressed, 'close'):
+				decompressed.close()
+
+
+	def __extract_zip(self, archive_path, only = None):
+		"""Extract zip members in parallel: the format allows random access and zlib releases the GIL"""
+		with ZipFile(archive_path) as zip_file:
+			members = zip_file.infolist()
+
+		names = [m.filename for m in members]
+		if only is not None:
+			members = [m for m in members if self.member_name(m.filename) in only]
+
+		# ZipFile.extract() creates missing parents without exist_ok, which races between
+		# workers: directories are all made here, and only files go to the workers
+		for m in members:
+			path = self.zip_member_path(m.filename)
+			makedirs(path if m.is_dir() else dirname(path), exist_ok=True)
+		members = [m for m in members if not m.is_dir()]
+
+		# Largest first, each on the least loaded worker
+		buckets = [[] for i in range(min(self.__jobs, max(1, len(members))))]
+		loads = [0] * len(buckets)
+		for m in sorted(members, key=lambda m: m.file_size, reverse=True):
+			i = loads.index(min(loads))
+			buckets[i].append(m)
+			loads[i] += m.file_size
+
+		def work(bucket):
+			with ZipFile(archive_path) as zip_file:
+				for m in bucket:
+					self.__extract_zip_member(zip_file, m)
+
+		with ThreadPoolExecutor(max_workers=len(buckets)) as pool:
+			for future in [pool.submit(work, b) for b in buckets]:
+				future.result()
+
+		return names
+
+
+	def zip_member_path(self, name):
+		"""Where ZipFile.extract() puts member name: without empty, . and .. components"""
+		return path_join(self.__destdir, *[p for p in name.split('/') if p not in ('', '.', '..')])
+
+
+	def __extract_zip_member(self, zip_file, member):
+		mode = member.external_attr >> 16
+		path = self.zip_member_path(member.filename)
+
+		if mode and S_ISLNK(mode):
+			makedirs(dirname(path), exist_ok=True)
+			if lexists(path):
+				remove(path)
+
+			symlink(zip_file.read(member).decode(), path)
+			return
+
+		zip_file.extract(member, self.__destdir)
+
+		# ZipFile ignores permissions, but build scripts rely on executable bits
+		if mode and not member.is_dir():
+			chmod(path, S_IMODE(mode))
+
+
+	def __extract_7z(self, archive_path):
+		for command in ('7z', '7za', '7zr'):
+			if which(command):
+				returncode = run_cmd([command, 'x', '-y', '-bd', '-o' + self.__destdir, archive_path], stdout=PIPE).returncode
+				if returncode != 0:
+					raise ExtractError('{0}: {1} exited with status {2}'.format(basename(archive_path), command, returncode))
+
+				listing = run_cmd([command, 'l', '-slt', archive_path], stdout=PIPE, universal_newlines=True).stdout
+				return [l[7:] for l in listing.splitlines() if l.startswith('Path = ')][1:]
+
+		raise ExtractError('{}: .7z archives need 7z, 7za or 7zr'.format(basename(archive_path)))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os import makedirs, environ
+from os.path import join as path_join, isdir, exists as path_exists, basename, expanduser, realpath
+from urllib.parse import urlsplit, parse_qs
+from hashlib import sha1
+from shutil import rmtree
+
+from git import Repo
+from git.exc import GitCommandError, InvalidGitRepositoryError, NoSuchPathError
+
+from fileutil import locked
+
+
+def default_mirror_path():
+	return path_join(environ.get('XDG_CACHE_HOME') or expanduser('~/.cache'), 'makedebpkg', 'git')
+
+
+class GitSourceError(Exception):
+	def __init__(self, message = 'Git Error: cannot check out source'):
+		super(GitSourceError, self).__init__(message)
+
+
+class GitSource(object):
+	"""A git source entry: [name::]git+url[#branch=|#tag=|#commit=ref][?signed]"""
+	def __init__(self, source):
+		super(GitSource, self).__init__()
+		name, sep, url = source.rpartition('::')
+		url, sep, fragment = url.partition('#')
+		if url.startswith('git+'):
+			url = url[4:]
+
+		# makepkg's ?signed query only asks for signature verification
+		parts = urlsplit(url)
+		if 'signed' in parse_qs(parts.query, keep_blank_values=True):
+			url = parts._replace(query='').geturl()
+
+		self.url = url
+		self.repository = basename(parts.path.rstrip('/'))
+		if self.repository.endswith('.git'):
+			self.repository = self.repository[:-4]
+		self.name = name or self.repository
+
+		self.kind, sep, self.ref = fragment.partition('=')
+		if self.kind and self.kind not in ('branch', 'tag', 'commit', 'revision'):
+			raise GitSourceError('{0}: unknown fragment #{1}'.format(source, fragment))
+
+
+	def revision(self):
+		"""The revision to check out, as understood by rev-parse in a mirror"""
+		if self.kind == 'branch':
+			return 'refs/heads/' + self.ref
+		if self.kind == 'tag':
+			return 'refs/tags/' + self.ref
+		if self.kind in ('commit', 'revision'):
+			return self.ref
+
+		return 'HEAD'
+
+
+class GitMirrorCache(object):
+	"""Persistent bare mirrors of git sources, refreshed with git fetch and checked out without cloning again
+
+	Mirrors live in rootdir/<name>-<hash of url>.git. Checkouts are worktrees
+	of the mirror, or clones borrowing its objects through --reference. depth
+	makes shallow mirrors and blobless makes partial ones (--filter=blob:none),
+	for builds that do not need the whole history."""
+	def __init__(self, rootdir, depth = None, blobless = False, reference = False):
+		super(GitMirrorCache, self).__init__()
+		self.__rootdir = rootdir
+		self.__depth = depth
+		self.__blobless = blobless
+		# git refuses shallow repositories as references, and partial mirrors fetch
+		# missing blobs on demand, which only works from the mirror itself
+		self.__reference = reference and not depth and not blobless
+
+		makedirs(rootdir, 0o755, exist_ok=True)
+
+
+	def mirror_path(self, source):
+		return path_join(self.__rootdir, '{0}-{1}.git'.format(source.repository, sha1(source.url.encode()).hexdigest()[:12]))
+
+
+	def __options(self, clone = False):
+		options = {}
+		if self.__depth:
+			options['depth'] = self.__depth
+			if clone:
+				# --depth implies --single-branch, but every branch is wanted
+				options['no_single_branch'] = True
+		if self.__blobless:
+			options['filter'] = 'blob:none'
+
+		return options
+
+
+	def update(self, source):
+		"""Create or refresh the mirror of source, returning its Repo"""
+		mirror = self.mirror_path(source)
+
+		if not isdir(mirror):
+			print('[ Git ] {0}: cloning mirror of {1}'.format(source.name, source.url))
+			return Repo.clone_from(source.url, mirror, mirror=True, **self.__options(True))
+
+		print('[ Git ] {}: fetching'.format(source.name))
+		repo = Repo(mirror)
+		repo.git.fetch('origin', prune=True, tags=True, **self.__options())
+
+		return repo
+
+
+	def resolve(self, repo, source):
+		"""Commit id of the revision source asks for, fetching it once if the mirror lacks it"""
+		revision = source.revision()
+		try:
+			return repo.git.rev_parse('--verify', revision + '^{commit}')
+		except GitCommandError:
+			pass
+
+		# Shallow mirrors only have the history of branch heads, and no commit outside of it
+		refspec = '+{0}:{0}'.format(revision) if revision.startswith('refs/') else revision
+		try:
+			repo.git.fetch('origin', refspec, **self.__options())
+			return repo.git.rev_parse('--verify', revision + '^{commit}')
+		except GitCommandError:
+			raise GitSourceError('{0}: no {1} named {2}'.format(source.name, source.kind, source.ref))
+
+
+	def checkout(self, source, srcdir):
+		"""Check out source in srcdir/<name>, returning the commit id"""
+		if not isinstance(source, GitSource):
+			source = GitSource(source)
+
+		mirror = self.mirror_path(source)
+		dest = path_join(srcdir, source.name)
+
+		try:
+			with locked(mirror + '.lock'):
+				repo = self.update(source)
+				commit = self.resolve(repo, source)
+
+				if self.__reference:
+					self.__clone(mirror, dest, commit)
+				else:
+					self.__worktree(repo, dest, commit)
+		except GitCommandError as e:
+			raise GitSourceError('{0}: {1}'.format(source.name, e.stderr.strip() or e))
+
+		print('[ Git ] {0}: {1} at {2}'.format(source.name, source.revision(), commit[:12]))
+		return commit
+
+
+	@staticmethod
+	def __worktree(repo, dest, commit):
+		if path_exists(path_join(dest, '.git')):
+			# A worktree of another mirror, or of one since removed, is made again
+			try:
+				checkout = Repo(dest)
+				if realpath(checkout.common_dir) == realpath(repo.git_dir):
+					checkout.git.checkout(commit, force=True, detach=True)
+					return
+			except (GitCommandError, InvalidGitRepositoryError, NoSuchPathError):
+				pass
+
+		if path_exists(dest):
+			rmtree(dest)
+
+		# Forget worktrees whose directory was removed along with an old srcdir
+		repo.git.worktree('prune')
+		repo.git.worktree('add', '--detach', '--force', dest, commit)
+
+
+	@staticmethod
+	def __clone(mirror, dest, commit):
+		if isdir(path_join(dest, '.git')):
+			checkout = Repo(dest)
+			checkout.git.fetch('origin', tags=True)
+		else:
+			if path_exists(dest):
+				rmtree(dest)
+			checkout = Repo.clone_from(mirror, dest, reference=mirror, no_checkout=True)
+
+		checkout.git.checkout(commit, force=True, detach=True)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+from http.client import HTTPConnection, HTTPSConnection, HTTPException, RemoteDisconnected
+from urllib.parse import urlsplit, urljoin
+from urllib.error import HTTPError
+from urllib.request import getproxies, proxy_bypass
+from threading import Lock
+
+
+# Statuses answered with a Location to follow
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class PooledResponse(object):
+	"""Response read through a pooled connection, which goes back to the pool once the body is consumed
+
+	It offers the subset of urlopen()'s responses used by the downloader:
+	status, info(), geturl(), read(), readinto() and close()."""
+	def __init__(self, pool, key, connection, response, url):
+		super(PooledResponse, self).__init__()
+		self.__pool = pool
+		self.__key = key
+		self.__connection = connection
+		self.__response = response
+		self.status = response.status
+		self.reason = response.reason
+		self.url = url
+
+
+	def info(self):
+		return self.__response.msg
+
+
+	def geturl(self):
+		return self.url
+
+
+	def read(self, size = -1):
+		return self.__response.read(None if size < 0 else size)
+
+
+	def readinto(self, buffer):
+		return self.__response.readinto(buffer)
+
+
+	def close(self):
+		"""Give the connection back if the whole body was read, close it otherwise"""
+		if self.__connection is None:
+			return
+
+		if self.__response.isclosed() and not self.__response.will_close:
+			self.__pool.release(self.__key, self.__connection)
+		else:
+			self.__connection.close()
+
+		self.__response.close()
+		self.__connection = None
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class ConnectionPool(object):
+	"""Keep-alive HTTP(S) connections, kept per scheme, host and port for the next request to the same server
+
+	Sources from a single upstream only pay for the TCP and TLS handshakes
+	once per connection instead of once per file."""
+	def __init__(self, per_host = 4, timeout = 60):
+		super(ConnectionPool, self).__init__()
+		self.__per_host = per_host
+		self.__timeout = timeout
+		self.__idle = {}
+		self.__lock = Lock()
+		self.opened = 0
+		self.reused = 0
+
+
+	@staticmethod
+	def supports(url):
+		"""Whether url can go through the pool: http or https, unless a proxy from the environment applies to it
+
+		Proxied requests are left to urlopen(), which honours http_proxy, https_proxy and no_proxy."""
+		parts = urlsplit(url)
+		if parts.scheme not in ('http', 'https'):
+			return False
+
+		return parts.scheme not in getproxies() or bool(proxy_bypass(parts.netloc))
+
+
+	def __connection(self, key):
+		"""An idle connection to key, or a new one, with whether it was reused"""
+		with self.__lock:
+			idle = self.__idle.get(key)
+			if idle:
+				self.reused += 1
+				return idle.pop(), True
+
+			self.opened += 1
+
+		scheme, host = key
+		connection_class = HTTPSConnection if scheme == 'https' else HTTPConnection
+		return connection_class(host, timeout=self.__timeout), False
+
+
+	def release(self, key, connection):
+		with self.__lock:
+			idle = self.__idle.setdefault(key, [])
+			if len(idle) < self.__per_host:
+				idle.append(connection)
+				return
+
+		connection.close()
+
+
+	def close(self):
+		with self.__lock:
+			idle, self.__idle = self.__idle, {}
+
+		for connections in idle.values():
+			for connection in connections:
+				connection.close()
+
+
+	def __request(self, url, headers, method):
+		parts = urlsplit(url)
+		key = (parts.scheme, parts.netloc)
+		target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+		connection, reused = self.__connection(key)
+		try:
+			connection.request(method, target, headers=headers)
+			response = connection.getresponse()
+		except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+			connection.close()
+			if not reused:
+				raise
+
+			# The server dropped the idle connection in the meantime
+			return self.__request(url, headers, method)
+		except:
+			connection.close()
+			raise
+
+		return PooledResponse(self, key, connection, response, url)
+
+
+	def open(self, url, headers = None, method = 'GET', redirects = 10):
+		"""Send a request and return its PooledResponse, following redirects
+
+		Like urlopen(), statuses from 300 on that are not followed raise HTTPError."""
+		headers = dict(headers or {})
+		for i in range(redirects + 1):
+			response = self.__request(url, headers, method)
+			if response.status < 300:
+				return response
+
+			# Bodies of redirects and errors are small: read them to keep the connection
+			info = response.info()
+			response.read()
+			response.close()
+
+			if response.status in REDIRECTS and info['Location']:
+				url = urljoin(url, info['Location'])
+				if response.status == 303:
+					method = 'GET'
+				continue
+
+			raise HTTPError(url, response.status, response.reason, info, None)
+
+		raise HTTPException('{0}: more than {1} redirects'.format(url, redirects))
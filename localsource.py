@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+from os.path import join as path_join, isfile, basename
+from urllib.parse import urlsplit, unquote
+
+from srccache import link_or_copy
+from srcbackends import FetchResult
+
+
+class LocalSources(object):
+	"""Sources found on the local filesystem, as paths relative to startdir or file:// urls
+
+	They are placed in srcdir as hardlinks, or reflinks across filesystems,
+	instead of being copied or read through urlopen. Like downloads, they are
+	yielded as FetchResults without digests, to be hashed from disk."""
+	def __init__(self, startdir, srcdir):
+		super(LocalSources, self).__init__()
+		self.__startdir = startdir
+		self.__srcdir = srcdir
+
+
+	def path(self, source):
+		url = source.rpartition('::')[2]
+		if url.startswith('file://'):
+			return unquote(urlsplit(url).path)
+
+		return path_join(self.__startdir, url)
+
+
+	@staticmethod
+	def filename(source):
+		name, sep, url = source.rpartition('::')
+		return name or basename(unquote(urlsplit(url).path))
+
+
+	def fetch_all(self, sources):
+		for source in sources:
+			path = self.path(source)
+			if not isfile(path):
+				yield FetchResult(source, error=FileNotFoundError('{} does not exist'.format(path)))
+				continue
+
+			try:
+				link_or_copy(path, path_join(self.__srcdir, self.filename(source)))
+				yield FetchResult(source, self.filename(source))
+			except OSError as e:
+				yield FetchResult(source, error=e)
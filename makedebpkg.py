@@ -31,99 +31,249 @@
 
 
 from argparse import ArgumentParser
-from os.path import realpath, dirname, isdir
-from sys import stderr
-from os import getuid, getcwd, mkdir, environ
-from tarfile import open as tar_open
-from zipfile import ZipFile
+from os.path import realpath, dirname, isdir, isfile, islink, getsize
+from sys import stderr, argv, executable
+from os import getuid, getcwd, mkdir, environ, listdir, rmdir, remove, replace, cpu_count
+from shutil import rmtree
+from collections import OrderedDict
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from atexit import register as atexit_register
 from subprocess import run as run_cmd
 
-from pkgdownload import PkgDownloadManager
-from pkgdata import PkgData
+from srccache import SourceCache
+from srcbackends import group_sources, load_backend, preload, SourceBackendError
+from pkgdata import PkgData, FIELDS
+from pkgcache import PkgCache, default_cache_path
+from expand import Expander
+from runner import StageRunner
+from tracing import Tracer
+from builddir import BuildDirectory, TMPFS_PATH
 from control import ControlData
-
-
-def expand_vars(pkgdata: PkgData, srcdir, pkgdir):
-	"""Expand Bash variables in strings, using PKGBUILD basic variables"""
+from checksum import hash_files, verify, ChecksumError
+from extract import Extractor, ExtractError, detect_format, read_header
+from debwriter import DebWriter, COMPRESSIONS
+from pkgscan import PkgScan
+from buildstate import BuildState
+from scheduler import BuildScheduler
+from repo import Repository, RepoError
+from depcheck import DpkgStatus, DependencyError, STATUS_PATH
+from daemon import BuildDaemon, submit, default_socket_path
+
+
+def expand_vars(pkgdata: PkgData, srcdir, pkgdir, pkgdirs = None):
+	"""Expand Bash variables in source, noextract, url and the fields set by package functions
+
+	Function bodies are left to bash: the build scripts declare every variable
+	this returns, resolved. pkgdirs maps each package of a split PKGBUILD to
+	its own pkgdir."""
 	if not isinstance(pkgdata, PkgData):
 		raise TypeError("Invalid type for pkgdata.")
-		
-
-	def replace_vars(s, pkgdata):
-		if s.find('${pkgver}') >= 0:
-		 	s = s.replace('${pkgver}', pkgdata.pkgver)
-
-		if s.find('${pkgname}') >= 0:
-		 	s = s.replace('${pkgname}', pkgdata.pkgname)
-
-		if s.find('${pkgrel}') >= 0:
-		 	s = s.replace('${pkgrel}', pkgdata.pkgrel)
 
-		if s.find('${epoch}') >= 0:
-		 	s = s.replace('${epoch}', pkgdata.epoch)
-
-		if s.find('${arch}') >= 0:
-		 	s = s.replace('${arch}', pkgdata.arch)
-
-		if s.find('$pkgname') >= 0:
-			s = s.replace('$pkgname', pkgdata.pkgname)
-
-		if s.find('$pkgver') >= 0:
-			s = s.replace('$pkgver', pkgdata.pkgver)
+	variables = dict(pkgdata.variables)
+	variables.update((field, getattr(pkgdata, field)) for field in FIELDS)
+	variables.update(epoch=pkgdata.epoch, srcdir=srcdir, pkgdir=pkgdir, startdir=dirname(srcdir))
+	if len(pkgdata.pkgnames) > 1:
+		variables['pkgname'] = pkgdata.pkgnames
+	expander = Expander(variables)
+
+	pkgdata.source = [expander.expand(i, False) for i in pkgdata.source]
+	pkgdata.noextract = [expander.expand(i, False) for i in pkgdata.noextract]
+	pkgdata.url = expander.expand(pkgdata.url, False)
+
+	# Inside package_<name>(), pkgname and pkgdir are those of the package being built
+	for name, pkg_dir in (pkgdirs or {}).items():
+		package_expander = Expander(dict(variables, pkgname=name, pkgdir=pkg_dir))
+		overrides = pkgdata.split_overrides.get(name, {})
+		for field, value in overrides.items():
+			if isinstance(value, list):
+				overrides[field] = [package_expander.expand(v, False) for v in value]
+			else:
+				overrides[field] = package_expander.expand(value, False)
 
-		if s.find('$pkgrel') >= 0:
-			s = s.replace('$pkgrel', pkgdata.pkgrel)
+	resolved = {}
+	for name, value in variables.items():
+		words = expander.lookup(name)
+		if words is not None:
+			resolved[name] = words if isinstance(value, (list, tuple)) else words[0]
 
-		if s.find('$arch') >= 0:
-			s = s.replace('$arch', pkgdata.arch)
+	return resolved
 
-		if s.find('${pkgdir}') >= 0:
-			s = s.replace('${pkgdir}', pkgdir)
 
-		if s.find('${pkgdir}') >= 0:
-			s = s.replace('${pkgdir}', pkgdir)
+class Argument(str):
+	"""A command line argument, told apart from equal ones by identity"""
 
-		if s.find('${srcdir}') >= 0:
-			s = s.replace('${srcdir}', srcdir)
 
-		if s.find('$srcdir') >= 0:
-			s = s.replace('$srcdir', srcdir)
+def merge_tree(src, dst):
+	"""Move the content of src into dst, replacing existing files, then remove src"""
+	for name in listdir(src):
+		s = src + '/' + name
+		d = dst + '/' + name
 
-		return s
+		if isdir(s) and not islink(s) and isdir(d) and not islink(d):
+			merge_tree(s, d)
+		else:
+			if isdir(d) and not islink(d):
+				rmtree(d)
 
-	for i in pkgdata.source:
-		pkgdata.source[pkgdata.source.index(i)] = replace_vars(i, pkgdata)
+			replace(s, d)
 
-	for i in pkgdata.prepare_instructions:
-		pkgdata.prepare_instructions[pkgdata.prepare_instructions.index(i)] = replace_vars(i, pkgdata)
+	rmdir(src)
 
-	for i in pkgdata.package_instructions:
-		pkgdata.package_instructions[pkgdata.package_instructions.index(i)] = replace_vars(i, pkgdata)
 
-	pkgdata.url = replace_vars(pkgdata.url, pkgdata)
+def clear_pkgdir(pkgdir):
+	"""Remove what a previous package() installed in pkgdir, keeping DEBIAN"""
+	for name in listdir(pkgdir):
+		path = pkgdir + '/' + name
+		if name == 'DEBIAN':
+			continue
 
+		if isdir(path) and not islink(path):
+			rmtree(path)
+		else:
+			remove(path)
 
 
 # Check
 # Package
 
-if __name__ == '__main__':
+def main(arguments, warm_cache = None, on_exit = atexit_register):
+	"""Run makedebpkg.py with arguments (argv without the program name)
+
+	warm_cache is a PkgCache already in memory, used instead of opening the
+	one at --parse-cache when they are the same file. on_exit registers what
+	must run once the build is over, even if it exits early."""
+	# Repository maintenance does not run any PKGBUILD code
+	if arguments[0:1] == ['repo']:
+		parser = ArgumentParser(prog='makedebpkg.py repo', description='update the Packages and Release files of a flat APT repository')
+		parser.add_argument('directory', help='the repository')
+		parser.add_argument('deb', nargs='*', help='packages to add to the repository')
+		parser.add_argument('--origin', type=str)
+		parser.add_argument('--label', type=str)
+		args = parser.parse_args(arguments[1:])
+
+		repository = Repository(args.directory)
+		try:
+			repository.add(args.deb)
+			if repository.update():
+				repository.write(args.origin, args.label)
+		except (OSError, RepoError) as e:
+			print('[ Repo ] {}'.format(e), file=stderr)
+			exit(7)
+
+		for name in repository.read:
+			print('[ Repo ] {}: indexed'.format(name))
+		for name in repository.removed:
+			print('[ Repo ] {}: removed'.format(name))
+		exit(0)
+
 	# Check if not root
 	if getuid() == 0:
 		print('{} cannot be run as root.'.format('makedebpkg.py'), file=stderr)
 		exit(1)
 
+	# Build daemon, and clients submitting jobs to it
+	if arguments[0:1] == ['daemon']:
+		parser = ArgumentParser(prog='makedebpkg.py daemon', description='serve builds on a Unix socket, keeping imports and caches warm')
+		parser.add_argument('--socket', type=str, default=default_socket_path())
+		parser.add_argument('-w', '--workers', type=int, default=cpu_count(), help='jobs run at once')
+		parser.add_argument('--parse-cache', type=str)
+		args = parser.parse_args(arguments[1:])
+
+		# Jobs are forked from the daemon: backends imported here are never imported again
+		preload()
+		BuildDaemon(args.socket, main, PkgCache(args.parse_cache), args.workers).serve()
+		exit(0)
+
+	if arguments[0:1] == ['submit']:
+		parser = ArgumentParser(prog='makedebpkg.py submit', usage='%(prog)s [--socket SOCKET] [--] ARGUMENTS...', allow_abbrev=False,
+			description='run a build on the daemon, from the current directory, with the arguments given to makedebpkg.py')
+		parser.add_argument('--socket', type=str, default=default_socket_path())
+
+		# Only --socket is read here: anything else, before or after the PKGBUILDs, belongs to the build
+		rest = arguments[1:]
+		after = []
+		if '--' in rest:
+			rest, after = rest[:rest.index('--')], rest[rest.index('--') + 1:]
+		args, forward = parser.parse_known_args(rest)
+		if forward and after:
+			forward.append('--')
+		forward += after
+
+		try:
+			exit(submit(args.socket, forward, getcwd(), environ))
+		except OSError as e:
+			print('[ Daemon ] {0}: {1}'.format(args.socket, e), file=stderr)
+			exit(9)
+
 	# Parsing args
 	parser = ArgumentParser()
-	parser.add_argument("PKGBUILD", type=str)
+	parser.add_argument("PKGBUILD", nargs='+', help='a PKGBUILD, or several PKGBUILDs and directories for a batch build')
 	parser.add_argument('--maintainer', type=str)
 	parser.add_argument('-e', '--essential', action='store_true')
 	parser.add_argument('-i', '--install', action='store_true')
-
-	args = parser.parse_args()
+	parser.add_argument('--parallel-downloads', type=int, default=4)
+	parser.add_argument('--per-host', type=int, default=2)
+	parser.add_argument('--download-buffer', type=int, default=256, metavar='KIB', help='size of the buffer each download is read into')
+	parser.add_argument('--limit-rate', type=int, metavar='KIB', help='bandwidth limit of the downloads of a build, in KiB/s')
+	parser.add_argument('-w', '--workers', type=int, help='packages built at once in batch mode (default: one per core)')
+	parser.add_argument('-f', '--force', action='store_true', help='run every stage, ignoring the previous build')
+	parser.add_argument('--skipchecksums', action='store_true')
+	parser.add_argument('--stream-extract', action='store_true', help='extract tarballs while they download')
+	parser.add_argument('--discard-archives', action='store_true', help='do not keep stream-extracted tarballs in src/')
+	parser.add_argument('--compression', choices=sorted(COMPRESSIONS), default='xz')
+	parser.add_argument('--compression-level', type=int)
+	parser.add_argument('--compression-threads', type=int)
+	parser.add_argument('--dpkg-deb', action='store_true', help='build the .deb with dpkg -b')
+	parser.add_argument('--parse-cache', type=str, help='cache of parsed PKGBUILDs (default: ~/.cache/makedebpkg/pkgdata.cache)')
+	parser.add_argument('--no-parse-cache', action='store_true')
+	parser.add_argument('--srcdest', type=str)
+	parser.add_argument('--srcdest-size', type=int, default=10240, help='source cache budget in MiB (0 = unlimited)')
+	parser.add_argument('--mirrors', type=str, metavar='FILE', help='JSON map of url prefixes to lists of mirror prefixes')
+	parser.add_argument('--mirror', action='append', default=[], metavar='PREFIX=MIRROR', help='also download sources below PREFIX from MIRROR')
+
+	parser.add_argument('--git-depth', type=int, help='keep git mirrors shallow, with this many commits')
+	parser.add_argument('--git-blobless', action='store_true', help='make partial git mirrors, fetching file contents on demand')
+	parser.add_argument('--git-reference', action='store_true', help='check out git sources as clones using --reference instead of worktrees')
+	parser.add_argument('-d', '--nodeps', action='store_true', help='do not check that depends and makedepends are installed')
+	parser.add_argument('--dpkg-status', type=str, default=STATUS_PATH, help='dpkg status file to check dependencies against')
+	parser.add_argument('--assume-installed', action='append', default=[], metavar='NAME', help='consider NAME installed, whatever its version')
+	parser.add_argument('--trace', metavar='FILE', help='write the timing of each phase to FILE, in Chrome trace-event format')
+	parser.add_argument('--stats', action='store_true', help='print a summary of the time and memory used by each phase')
+	parser.add_argument('--tmpfs', nargs='?', const=TMPFS_PATH, metavar='PATH', help='keep src/ and the pkgdirs on a RAM-backed filesystem (default: {})'.format(TMPFS_PATH))
+	parser.add_argument('--tmpfs-size', type=int, default=0, metavar='MIB', help='tmpfs budget, spilling to disk beyond it (default: half the free space)')
+	parser.add_argument('--tmpfs-logs', action='store_true', help='move the build logs back from tmpfs')
+
+	# PKGBUILD has no type, so its values are these very objects
+	arguments = [Argument(a) for a in arguments]
+	args = parser.parse_args(arguments)
+
+	parse_cache = None
+	if not args.no_parse_cache:
+		if warm_cache is not None and warm_cache.path == (args.parse_cache or default_cache_path()):
+			parse_cache = warm_cache
+		else:
+			parse_cache = PkgCache(args.parse_cache)
+
+	# Batch mode: every other option is passed on to each build
+	if len(args.PKGBUILD) > 1 or isdir(args.PKGBUILD[0]):
+		# The PKGBUILDs are removed by position, as an option value may be equal to one of them
+		positional = set(id(p) for p in args.PKGBUILD)
+		forward = [a for a in arguments if id(a) not in positional]
+		scheduler = BuildScheduler(args.PKGBUILD, [executable, realpath(__file__)] + forward, args.workers, cache=parse_cache)
+		success = scheduler.run()
+		scheduler.print_summary()
+		exit(0 if success else 5)
+
+	tracer = Tracer()
+	if args.trace:
+		trace_path = realpath(args.trace)
+		on_exit(lambda: tracer.write_chrome_trace(trace_path))
+	if args.stats:
+		on_exit(tracer.print_stats)
 
 	# Parsing basic paths
-	pkgbuild_path = args.PKGBUILD
+	pkgbuild_path = args.PKGBUILD[0]
 	
 	if args.maintainer:
 		maintainer = args.maintainer
@@ -136,103 +286,377 @@ if __name__ == '__main__':
 	rootpath = getcwd()
 	srcdir_path = rootpath + '/src'
 
-	if not isdir(srcdir_path):
-		mkdir(srcdir_path, 0o755)
-
 	# Parsing PKGBUILD
-	pkgparser = PkgData()
-	pkgparser.parse(pkgbuild_path)
+	with tracer.span('parse') as span:
+		span.bytes = getsize(pkgbuild_path)
+		if parse_cache is None:
+			pkgparser = PkgData()
+			pkgparser.parse(pkgbuild_path)
+		else:
+			pkgparser = parse_cache.load(pkgbuild_path)
+			parse_cache.save()
+			span.args['cache_hits'] = parse_cache.hits
 
-	# Final pkgdir name
-	pkgdir_name = pkgparser.pkgname + ('-' + pkgparser.pkgver if pkgparser.pkgver != '' else '')
+	# Final pkgdir names, one per package of a split PKGBUILD
+	version_suffix = '-' + pkgparser.pkgver if pkgparser.pkgver != '' else ''
 	if pkgparser.pkgrel != '':
-		pkgdir_name += '-' + pkgparser.pkgrel
+		version_suffix += '-' + pkgparser.pkgrel
 
 	if pkgparser.epoch != 0:
-		pkgdir_name += '-' + str(pkgparser.epoch)
+		version_suffix += '-' + str(pkgparser.epoch)
+
+	pkgnames = pkgparser.pkgnames or [pkgparser.pkgname]
+	split = len(pkgnames) > 1
+	pkgdirs = OrderedDict((name, rootpath + '/' + name + version_suffix) for name in pkgnames)
+	pkgdir = pkgdirs[pkgnames[0]]
+
+	# src/ and the pkgdirs, on tmpfs behind symlinks of the same names
+	builddir = None
+	tree_names = ['src'] + [d.rpartition('/')[2] for d in pkgdirs.values()]
+	if args.tmpfs:
+		builddir = BuildDirectory(rootpath, args.tmpfs, args.tmpfs_size << 20)
+		on_exit(lambda: builddir.finish(args.tmpfs_logs))
+		builddir.place(tree_names)
+	else:
+		BuildDirectory(rootpath).release(tree_names)
 
-	pkgdir = rootpath + '/' + pkgdir_name
+	# Written into src/ once prepare(), build() and check() are done: without it, their outputs are gone
+	marker_path = srcdir_path + '/.stages-done'
+	tree_present = isfile(marker_path)
 
-	if not isdir(pkgdir):
-		mkdir(pkgdir, 0o755)
+	if not isdir(srcdir_path):
+		mkdir(srcdir_path, 0o755)
 
-	debdir = pkgdir + '/DEBIAN'
-	if not isdir(debdir):
-		mkdir(debdir, 0o755)
+	for d in pkgdirs.values():
+		for path in (d, d + '/DEBIAN'):
+			if not isdir(path):
+				mkdir(path, 0o755)
 
 	# Expanding Bash vars
-	expand_vars(pkgparser, srcdir_path, pkgdir)
+	with tracer.span('expand'):
+		shell_variables = expand_vars(pkgparser, srcdir_path, pkgdir, pkgdirs if split else None)
 	pkgparser.print_debug()
 
+	# Checking dependencies, before anything is downloaded
+	if not args.nodeps:
+		with tracer.span('depends'):
+			try:
+				# Packages of a split PKGBUILD may depend on each other
+				depends = pkgparser.depends + pkgparser.makedepends
+				depends += [d for o in pkgparser.split_overrides.values() for d in o.get('depends', [])]
+				status = DpkgStatus(args.dpkg_status, args.assume_installed + pkgnames)
+				missing = status.missing(list(OrderedDict.fromkeys(depends)))
+			except (OSError, DependencyError) as e:
+				print('[ Depends ] {}'.format(e), file=stderr)
+				exit(8)
+
+		if missing:
+			print('[ Depends ] missing dependencies:', file=stderr)
+			for dep in missing:
+				print('  ' + dep, file=stderr)
+			exit(8)
+
 	# Downloading source
-	dw = PkgDownloadManager(srcdir_path)
+	srcdest = args.srcdest or environ.get('SRCDEST')
+	cache = SourceCache(srcdest, args.srcdest_size << 20) if srcdest else None
+
+	# Sources are grouped by backend, and a backend is imported only if one of them needs it:
+	# GitPython, for one, is not loaded by builds without git sources
+	try:
+		backends = group_sources(pkgparser.source)
+		modules = {name: load_backend(name) for name in backends}
+	except SourceBackendError as e:
+		print('[ Source ] {}'.format(e), file=stderr)
+		exit(2)
+
+	downloads = backends.get('http', [])
+	local = backends.get('local', [])
+	commits = {}
+
+	if 'git' in backends:
+		gitcache = modules['git']
+		mirrors_path = srcdest + '/git' if srcdest else gitcache.default_mirror_path()
+		try:
+			mirrors = gitcache.GitMirrorCache(mirrors_path, args.git_depth, args.git_blobless, args.git_reference)
+		except OSError as e:
+			print('[ Git ] {0}: {1}'.format(mirrors_path, e), file=stderr)
+			exit(2)
+
+		for i in backends['git']:
+			with tracer.span('git ' + i, 'download'):
+				try:
+					commits[i] = mirrors.checkout(i, srcdir_path)
+				except gitcache.GitSourceError as e:
+					print('[ Git ] {}'.format(e), file=stderr)
+					exit(2)
+
+	# Expected digests, per source url
+	checksums = {}
+	if not args.skipchecksums:
+		checksums = {url: pkgparser.checksums(i) for i, url in enumerate(pkgparser.source)}
+
+	algorithms = set()
+	for expected in checksums.values():
+		algorithms.update(a for a, v in expected.items() if v.upper() != 'SKIP')
+
+	if not args.skipchecksums and not algorithms and (downloads or local):
+		print('[ Checksum ] No checksums in PKGBUILD: sources will not be verified.', file=stderr)
+
+	# Previous results are gone if tmpfs was emptied since the last build
+	state = BuildState(rootpath + '/.buildstate.json', args.force or (builddir is not None and builddir.fresh))
+
+	# Identity of each source, for the stage fingerprints
+	sources_state = dict(commits)
+
+	def verify_source(result, digests):
+		try:
+			verify(result.filename, digests, checksums.get(result.url, {}))
+		except ChecksumError as e:
+			print('[ Checksum ] {}'.format(e), file=stderr)
+			if result.extracted:
+				rmtree(result.extracted)
+			exit(4)
+
+		if [v for v in checksums.get(result.url, {}).values() if v.upper() != 'SKIP']:
+			print('[ Checksum ] {}: Passed'.format(result.filename))
+
+		archive_path = srcdir_path + '/' + result.filename
+		if digests:
+			sources_state[result.url] = digests
+		elif isfile(archive_path):
+			sources_state[result.url] = Extractor.archive_key(archive_path)
+		else:
+			sources_state[result.url] = result.filename
+
+	def extract_source(result):
+		archive_path = srcdir_path + '/' + result.filename
+
+		if result.extracted:
+			with tracer.span('merge ' + result.filename, 'extract'):
+				merge_tree(result.extracted, srcdir_path)
+				if isfile(archive_path):
+					extractor.record(archive_path, result.members)
+
+		elif result.url not in pkgparser.noextract and result.filename not in pkgparser.noextract:
+			# Plain files, such as local patches, are used as they are
+			with open(archive_path, 'rb') as f:
+				if detect_format(read_header(f)) is None:
+					return
+
+			with tracer.span('extract ' + result.filename, 'extract') as span:
+				span.bytes = getsize(archive_path)
+				try:
+					span.args['changed'] = extractor.extract(archive_path)
+				except ExtractError as e:
+					print('[ Extract ] {}'.format(e), file=stderr)
+					exit(3)
 
-	for i in pkgparser.source:
-		p = i.find('+')
-		if p >= 0: 
-			if i[:p] == 'git':
-				dw.git(i[:p + 1])
+	extractor = Extractor(srcdir_path)
+
+	# Archives are verified and extracted as soon as they arrive, while the rest keep downloading.
+	# After a previous build, extraction waits for every source instead: if prepare() is
+	# unchanged, the tree it left behind is reused rather than extracted again.
+	defer_extraction = state.has_previous()
+	deferred = []
+	failed = []
+	on_disk = []
+	stream_to = srcdir_path if args.stream_extract else None
+	fetches = []
+	if local:
+		fetches.append(modules['local'].LocalSources(rootpath, srcdir_path).fetch_all(local))
+	if downloads:
+		http = modules['http']
+		try:
+			mirror_map = http.MirrorMap.load(args.mirrors) if args.mirrors else http.MirrorMap()
+		except (OSError, ValueError) as e:
+			print('[ Mirror ] {0}: {1}'.format(args.mirrors, e), file=stderr)
+			exit(2)
+		for i in args.mirror:
+			prefix, sep, mirror = i.partition('=')
+			mirror_map.add(prefix, [mirror])
+
+		dw = http.PkgDownloadManager(srcdir_path, args.parallel_downloads, args.per_host, cache, tracer, mirror_map, args.download_buffer << 10, args.limit_rate << 10 if args.limit_rate else None)
+		fetches.append(dw.fetch_all(downloads, sorted(algorithms), stream_to, pkgparser.noextract, not args.discard_archives))
+
+	for result in chain(*fetches):
+		if not result.ok:
+			print('[ Download ] {0}: {1}'.format(result.url, result.error), file=stderr)
+			failed.append(result)
+			continue
+
+		if result.digests is None and algorithms:
+			# Not transferred (cached or unchanged): hashed from disk below
+			on_disk.append(result)
+			continue
+
+		verify_source(result, result.digests or {})
+		if defer_extraction:
+			deferred.append(result)
+		else:
+			extract_source(result)
+
+	with tracer.span('checksum', 'download') as span:
+		on_disk_paths = [srcdir_path + '/' + r.filename for r in on_disk]
+		span.bytes = sum(getsize(p) for p in on_disk_paths)
+		on_disk_digests = hash_files(on_disk_paths, sorted(algorithms))
+	for result in on_disk:
+		verify_source(result, on_disk_digests[srcdir_path + '/' + result.filename])
+		if defer_extraction:
+			deferred.append(result)
+		else:
+			extract_source(result)
 
-			elif i[:p] in ['svn', 'bzr', 'hg']:
-				print('{0} is currently not supported.'.format(i[:p]), file=stderr)
-				exit(2)
+	if failed:
+		print('{} source(s) could not be downloaded.'.format(len(failed)), file=stderr)
+		exit(2)
 
-			else:
-				print('{} is an invalid VCS.'.format(i[:p]))
-				exit(2)
 
+	if builddir:
+		builddir.check()
+
+	# Stage fingerprints
+	# Function bodies are not expanded: the values of the variables they use are part of the fingerprint
+	variables = dict(shell_variables, pkgnames=pkgparser.pkgnames)
+	fingerprint = state.fingerprint(sorted(variables.items()), sorted(sources_state.items()), pkgparser.noextract)
+
+	stages = [
+		('prepare', pkgparser.prepare_instructions),
+		('build', pkgparser.build_instructions),
+		('check', pkgparser.check_instructions)
+	]
+
+	if deferred:
+		if tree_present and state.unchanged('prepare', state.fingerprint('prepare', pkgparser.prepare_instructions, fingerprint)):
+			state.note('extract', 'skipped', 'sources and prepare() unchanged')
+			for result in deferred:
+				if result.extracted:
+					rmtree(result.extracted)
 		else:
-			filename = dw.get(i)
-			archive_path = srcdir_path + '/' + filename
-			# Checksum dump here
+			state.note('extract', 'ran', 'sources or prepare() changed' if tree_present else 'outputs missing')
+			for result in deferred:
+				extract_source(result)
 
-			if i not in pkgparser.noextract:
-				# Extract archive
-				ext = filename.split('.')[-1]
 
-				if ext == 'zip':
-					with ZipFile(archive_path) as zip_file:
-						zip_file.extractall(srcdir_path)
+	# Building package
+	runner = StageRunner(shell_variables, srcdir_path, builddir.log_prefix(pkgdir) if builddir else pkgdir)
+	for stage, instructions in stages:
+		fingerprint = state.fingerprint(stage, instructions, fingerprint)
+
+		if not instructions:
+			state.done(stage, fingerprint)
+			continue
+
+		if not state.should_run(stage, fingerprint, tree_present):
+			continue
+
+		print('[ {}() ]'.format(stage))
+		with tracer.span(stage + '()', 'stage'):
+			result = runner.run(stage, instructions)
+			# Likely out of space on tmpfs: the stage runs again on disk
+			if not result.ok and builddir and builddir.check():
+				runner.print_result(result)
+				result = runner.run(stage, instructions)
+		runner.print_result(result)
+		if not result.ok:
+			exit(6)
+
+		state.done(stage, fingerprint)
+		if builddir:
+			builddir.check()
+
+	open(marker_path, 'w').close()
+
+
+	# Packaging: build() and check() ran once, the package functions of a split PKGBUILD run in parallel
+	packages = OrderedDict((name, pkgparser.split(name) if split else pkgparser) for name in pkgnames)
+	package_fingerprints = {}
+	pending = []
+
+	for name, pkg in packages.items():
+		stage = 'package_' + name if split else 'package'
+		overrides = pkgparser.split_overrides.get(name, {})
+		package_fingerprints[name] = state.fingerprint(stage, pkg.package_instructions, overrides, fingerprint)
+		outputs_present = [d for d in listdir(pkgdirs[name]) if d != 'DEBIAN']
+
+		if not pkg.package_instructions:
+			state.done(stage, package_fingerprints[name])
+		elif state.should_run(stage, package_fingerprints[name], outputs_present):
+			pending.append((name, stage))
+
+	def run_package(name, stage):
+		with tracer.span(stage + '()', 'stage'):
+			# Files that this package() no longer installs must not stay in the .deb
+			clear_pkgdir(pkgdirs[name])
+			if not split:
+				return runner.run(stage, packages[name].package_instructions)
+
+			# Each package of a split PKGBUILD logs next to its own pkgdir
+			logprefix = builddir.log_prefix(pkgdirs[name]) if builddir else pkgdirs[name]
+			return runner.run(stage, packages[name].package_instructions, {'pkgname': name, 'pkgdir': pkgdirs[name]}, '[{}] '.format(name), logprefix)
+
+	if pending:
+		print('[ {} ]'.format(', '.join(stage + '()' for name, stage in pending)))
+
+	with ThreadPoolExecutor(max_workers=len(pending) or 1) as pool:
+		futures = [(name, stage, pool.submit(run_package, name, stage)) for name, stage in pending]
+
+	results = [(name, stage, future.result()) for name, stage, future in futures]
+	if builddir and builddir.check():
+		results = [(name, stage, result if result.ok else run_package(name, stage)) for name, stage, result in results]
+
+	failed = False
+	for name, stage, result in results:
+		runner.print_result(result)
+		if result.ok:
+			state.done(stage, package_fingerprints[name])
+		else:
+			failed = True
 
-				elif ext == 'rar':
-					print('.rar is currently unsupported.', file=stderr)
-					exit(3)
+	if failed:
+		exit(6)
 
-				elif filename.split('.')[-2] == 'tar' or ext == 'tar':
-					with tar_open(archive_path) as tar_file:
-						tar_file.extractall(srcdir_path)
 
+	debs = []
+	for name, pkg in packages.items():
+		pkg_dir = pkgdirs[name]
+		debdir = pkg_dir + '/DEBIAN'
 
-	# Building package
-	if pkgparser.prepare_instructions:
-		print('[ prepare() ]')
-		for i in pkgparser.prepare_instructions:
-			run_cmd(i.replace('"', '').split()).check_returncode()
+		# Scanning the package tree once, for md5sums, Installed-Size and the deb
+		with tracer.span('scan ' + name) as span:
+			scan = PkgScan(pkg_dir)
+			scan.write_md5sums(debdir + '/md5sums')
+			span.bytes = scan.size
 
-	if pkgparser.build_instructions:
-		print('[ build() ]')
-		for i in pkgparser.build_instructions:
-			run_cmd(i.replace('"', '').split()).check_returncode()
+		# Generating control file
+		with tracer.span('control ' + name):
+			con = ControlData()
+			con.import_from_pkgdata(pkg, maintainer, args.essential)
+			con.installed_size = scan.installed_size
+			con.export(debdir + '/control')
 
-	if pkgparser.check_instructions:
-		print('[ check() ]')
-		for i in pkgparser.check_instructions:
-			run_cmd(i.replace('"', '').split()).check_returncode()
 
-	if pkgparser.package_instructions:
-		print('[ package() ]')
-		for i in pkgparser.package_instructions:
-			run_cmd(i.replace('"', '').split()).check_returncode()
+		# Building deb package, again if the tree changed since, even without package() running
+		stage = 'deb_' + name if split else 'deb'
+		fingerprint_deb = state.fingerprint(stage, package_fingerprints[name], scan.fingerprint(), con.dumps(), args.dpkg_deb, args.compression, args.compression_level)
 
+		if state.should_run(stage, fingerprint_deb, isfile(pkg_dir + '.deb')):
+			with tracer.span('deb ' + name) as span:
+				if args.dpkg_deb:
+					run_cmd(['dpkg', '-b', pkg_dir]).check_returncode()
+				else:
+					print('[ Deb ] building package \'{0}\' in \'{1}\'.'.format(con.package, pkg_dir + '.deb'))
+					DebWriter(args.compression, args.compression_level, args.compression_threads).write(pkg_dir, pkg_dir + '.deb', con, scan)
+				span.bytes = getsize(pkg_dir + '.deb')
 
-	# Generating control file
-	con = ControlData()
-	con.import_from_pkgdata(pkgparser, maintainer, args.essential)
-	con.export(debdir + '/control')
+			state.done(stage, fingerprint_deb)
 
+		debs.append(pkg_dir + '.deb')
 
-	# Building deb package
-	run_cmd(['dpkg', '-b', pkgdir])
+	state.print_report()
 
 	if args.install:
-		run_cmd(['dpkg', '-i', '{}'.format(pkgdir + '.deb')])
\ No newline at end of file
+		run_cmd(['dpkg', '-i'] + debs)
+
+
+if __name__ == '__main__':
+	main(argv[1:])
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+from http.client import HTTPException, IncompleteRead
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
+from time import perf_counter
+from json import load as json_load
+
+
+# Bytes asked for by a probe, and size of the transfer scores are estimated for
+PROBE_SIZE = 1 << 16
+ESTIMATE_SIZE = 1 << 20
+
+# Errors after which a transfer moves on to the next location
+TRANSFER_ERRORS = (OSError, HTTPException)
+
+
+class MirrorMap(object):
+	"""Alternative locations of sources, as url prefixes mapped to lists of mirror prefixes
+
+	A prefix can be a whole url, giving the mirrors of a single source, or
+	the root of an upstream, e.g. https://ftp.gnu.org/gnu/, for every source
+	below it. The longest matching prefix wins."""
+	def __init__(self, mapping = None):
+		super(MirrorMap, self).__init__()
+		self.__mapping = {}
+		for prefix, mirrors in (mapping or {}).items():
+			self.add(prefix, mirrors)
+
+
+	@classmethod
+	def load(cls, path):
+		"""Read a map from a JSON file: {"prefix": ["mirror prefix", ...], ...}"""
+		with open(path, 'r') as f:
+			return cls(json_load(f))
+
+
+	def add(self, prefix, mirrors):
+		if not isinstance(mirrors, list) or not all(isinstance(m, str) for m in mirrors):
+			raise ValueError('{}: mirrors must be a list of url prefixes'.format(prefix))
+
+		self.__mapping.setdefault(prefix, [])
+		self.__mapping[prefix].extend(m for m in mirrors if m not in self.__mapping[prefix])
+
+
+	def __bool__(self):
+		return bool(self.__mapping)
+
+
+	def locations(self, url):
+		"""url, followed by its location on every mirror"""
+		prefixes = [p for p in self.__mapping if url.startswith(p)]
+		if not prefixes:
+			return [url]
+
+		prefix = max(prefixes, key=len)
+		locations = [url]
+		for mirror in self.__mapping[prefix]:
+			location = mirror + url[len(prefix):]
+			if location not in locations:
+				locations.append(location)
+
+		return locations
+
+
+class MirrorRanker(object):
+	"""Orders the locations of a source by the latency and throughput of a small ranged request to each server
+
+	A probe reads the first PROBE_SIZE bytes of the file: the time to the
+	first byte gives the latency, the rest the throughput. Servers are scored
+	by the time they would take for ESTIMATE_SIZE bytes, and probed once;
+	those that do not answer, or not within timeout seconds, come last."""
+	def __init__(self, opener, jobs = 4, timeout = 2.0):
+		super(MirrorRanker, self).__init__()
+		self.__opener = opener
+		self.__jobs = max(1, jobs)
+		self.__timeout = timeout
+		self.__scores = {}
+		self.__lock = Lock()
+
+
+	def probe(self, url):
+		"""Latency in seconds and throughput in bytes per second of the server of url, or None if it failed"""
+		start = perf_counter()
+		try:
+			with self.__opener(url, {'Range': 'bytes=0-{}'.format(PROBE_SIZE - 1)}) as response:
+				received = len(response.read(1))
+				latency = perf_counter() - start
+				# Servers ignoring Range send the whole file: the connection is dropped after the probe
+				received += len(response.read(PROBE_SIZE - 1))
+		except TRANSFER_ERRORS:
+			return None
+
+		elapsed = perf_counter() - start - latency
+		return latency, received / elapsed if elapsed > 0 else float('inf')
+
+
+	def score(self, url):
+		host = urlsplit(url).netloc
+		with self.__lock:
+			if host in self.__scores:
+				return self.__scores[host]
+
+		probe = self.probe(url)
+		score = None
+		if probe:
+			latency, throughput = probe
+			score = latency + ESTIMATE_SIZE / throughput
+
+		with self.__lock:
+			self.__scores[host] = score
+
+		return score
+
+
+	def rank(self, locations):
+		if len(locations) < 2:
+			return list(locations)
+
+		# Probes still running after the timeout are left to finish in the background
+		pool = ThreadPoolExecutor(max_workers=min(self.__jobs, len(locations)))
+		futures = [pool.submit(self.score, location) for location in locations]
+		wait(futures, self.__timeout)
+		pool.shutdown(wait=False)
+
+		scores = [f.result() if f.done() else None for f in futures]
+
+		order = sorted(range(len(locations)), key=lambda i: (scores[i] is None, scores[i] or 0, i))
+		return [locations[i] for i in order]
+
+
+class FailoverStream(object):
+	"""Body of a download that carries on from the next location when the transfer breaks off
+
+	The next location is asked for the rest of the file with a Range request
+	at the current offset, so the bytes already received are kept. total, the
+	expected size of the file, also lets a connection closed early count as a
+	failure. Failovers are reported through message(text)."""
+	def __init__(self, response, alternatives, opener, offset = 0, total = None, name = None, message = print):
+		super(FailoverStream, self).__init__()
+		self.__response = response
+		self.__alternatives = list(alternatives)
+		self.__opener = opener
+		self.__offset = offset
+		self.__total = total
+		self.__name = name or urlsplit(response.geturl()).path
+		self.__message = message
+
+
+	def __failover(self, error):
+		while self.__alternatives:
+			url = self.__alternatives.pop(0)
+			try:
+				response = self.__opener(url, {'Range': 'bytes={}-'.format(self.__offset)})
+			except TRANSFER_ERRORS:
+				continue
+
+			resumed = response.status == 206 and (response.info()['Content-Range'] or '').startswith('bytes {}-'.format(self.__offset))
+			if resumed or (response.status == 200 and not self.__offset):
+				self.__message('[ Mirror ] {0}: {1}, resuming at {2} from {3}'.format(self.__name, error, self.__offset, url))
+				self.__response.close()
+				self.__response = response
+				return
+
+			response.close()
+
+		raise error
+
+
+	def __transfer(self, read):
+		while True:
+			try:
+				n = read()
+				if not n and self.__total is not None and self.__offset < self.__total:
+					raise IncompleteRead(b'', self.__total - self.__offset)
+
+				return n
+			except TRANSFER_ERRORS as e:
+				self.__failover(e)
+
+
+	def read(self, size = -1):
+		data = self.__transfer(lambda: self.__response.read(size))
+		self.__offset += len(data)
+		return data
+
+
+	def readinto(self, buffer):
+		n = self.__transfer(lambda: self.__response.readinto(buffer))
+		self.__offset += n
+		return n
+
+
+	def close(self):
+		self.__response.close()
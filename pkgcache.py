@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os import stat, makedirs, environ
+from os.path import dirname, realpath, expanduser, join as path_join
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from hashlib import sha256
+from marshal import dumps as marshal_dumps, loads as marshal_loads
+
+from pkgdata import PkgData
+from fileutil import atomic_write
+
+
+MAGIC = b'MDPKGC01'
+
+# Magic, then the offset of the marshalled index
+HEADER = Struct('<8sQ')
+
+
+def default_cache_path():
+	return path_join(environ.get('XDG_CACHE_HOME') or expanduser('~/.cache'), 'makedebpkg', 'pkgdata.cache')
+
+
+class PkgCache(object):
+	"""On-disk cache of parsed PKGBUILDs
+
+	The file holds one marshalled PkgData.fields() record per PKGBUILD, then an
+	index mapping each path to its mtime, size, sha256 and record position.
+	Only the index is read when the cache is opened: records are decoded from
+	a memory map on access. A PKGBUILD whose mtime and size did not change is
+	served without reading it; one that was touched but has the same content
+	hash is not parsed again."""
+	def __init__(self, path = None):
+		super(PkgCache, self).__init__()
+		self.__path = path or default_cache_path()
+		self.__index = {}
+		self.__records = {}
+		self.__map = None
+		self.__dirty = False
+		self.__stamp = None
+		self.hits = 0
+		self.misses = 0
+
+		self.refresh()
+
+
+	@property
+	def path(self):
+		return self.__path
+
+
+	def refresh(self):
+		"""Read the cache file again if another process replaced it since it was opened
+
+		Does nothing while entries loaded here are waiting to be saved."""
+		if self.__dirty:
+			return
+
+		try:
+			st = stat(self.__path)
+		except OSError:
+			return
+
+		if (st.st_mtime_ns, st.st_size, st.st_ino) == self.__stamp:
+			return
+
+		self.__stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+		try:
+			self.__open()
+		except (OSError, ValueError, EOFError, TypeError):
+			# Unreadable or from another version: start over
+			self.__index = {}
+			self.__map = None
+
+
+	def __open(self):
+		with open(self.__path, 'rb') as f:
+			self.__map = mmap(f.fileno(), 0, access=ACCESS_READ)
+
+		magic, index_offset = HEADER.unpack_from(self.__map, 0)
+		if magic != MAGIC:
+			raise ValueError
+
+		slots, self.__index = marshal_loads(self.__map[index_offset:])
+		if tuple(slots) != PkgData.__slots__:
+			raise ValueError
+
+
+	def __record(self, path):
+		"""Marshalled fields of path, from memory or from the cache file"""
+		if path in self.__records:
+			return self.__records[path]
+
+		offset, length = self.__index[path][3:5]
+		return self.__map[offset:offset + length]
+
+
+	def load(self, filename):
+		"""PkgData for filename, parsing it only if it changed since it was cached"""
+		path = realpath(filename)
+		st = stat(path)
+		entry = self.__index.get(path)
+
+		if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+			self.hits += 1
+			return PkgData.from_fields(marshal_loads(self.__record(path)))
+
+		with open(path, 'rb') as f:
+			data = f.read()
+
+		digest = sha256(data).hexdigest()
+
+		if entry and entry[2] == digest:
+			# Touched, not modified
+			self.hits += 1
+			record = self.__record(path)
+		else:
+			self.misses += 1
+			pkgdata = PkgData()
+			pkgdata.parse_text(data.decode())
+			record = marshal_dumps(pkgdata.fields())
+
+		self.__records[path] = record
+		self.__index[path] = (st.st_mtime_ns, st.st_size, digest, 0, len(record))
+		self.__dirty = True
+
+		return PkgData.from_fields(marshal_loads(record))
+
+
+	def save(self):
+		"""Write the cache back if anything changed, silently giving up if it is not writable"""
+		if not self.__dirty:
+			return
+
+		try:
+			makedirs(dirname(self.__path), exist_ok=True)
+
+			with atomic_write(self.__path, 'wb') as f:
+				f.write(HEADER.pack(MAGIC, 0))
+				index = {}
+
+				for path, entry in self.__index.items():
+					record = self.__record(path)
+					index[path] = entry[:3] + (f.tell(), len(record))
+					f.write(record)
+
+				index_offset = f.tell()
+				f.write(marshal_dumps((PkgData.__slots__, index)))
+				f.seek(0)
+				f.write(HEADER.pack(MAGIC, index_offset))
+
+		except OSError:
+			return
+
+		self.__dirty = False
@@ -29,12 +29,88 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
 
+from collections import OrderedDict
+from bisect import bisect_right
+from itertools import accumulate
+import re
+
+from checksum import ALGORITHMS
+
+
+# Pieces of a shell word: blanks, line continuation, newline, ';', ')', comment,
+# 'single quoted', "double quoted", \escaped character, unquoted text
+WORD_PART = re.compile(r"""[ \t\r\f\v]+|\\\n|\n|;|\)|#[^\n]*|'([^']*)'|"((?:[^"\\]|\\.)*)"|\\(.)|([^\s'"();\\]+)""", re.S)
+PLAIN = re.compile(r"""[^\s'"();\\]+""")
+DOUBLE_ESCAPE = re.compile(r'\\([$`"\\\n])')
+
+ASSIGNMENT = re.compile(r'[ \t]*([A-Za-z_][A-Za-z0-9_]*)(\+?=)')
+FUNCTION = re.compile(r'[ \t]*(?:function[ \t]+)?([A-Za-z_][A-Za-z0-9_.+-]*)[ \t]*\(\)[ \t]*(\{)?')
+
+# PKGBUILD field -> kind of value
+FIELDS = {
+	'pkgbase': 'scalar',
+	'pkgname': 'scalar',
+	'pkgver': 'scalar',
+	'pkgrel': 'scalar',
+	'pkgdesc': 'scalar',
+	'url': 'scalar',
+	'install': 'scalar',
+	'changelog': 'scalar',
+	'arch': 'array',
+	'license': 'array',
+	'groups': 'array',
+	'depends': 'array',
+	'optdepends': 'optdepends',
+	'makedepends': 'array',
+	'provides': 'array',
+	'conflicts': 'array',
+	'replaces': 'array',
+	'backup': 'array',
+	'options': 'array',
+	'source': 'array',
+	'noextract': 'array',
+	'validpgpkeys': 'array'
+}
+FIELDS.update((field, 'array') for field in ALGORITHMS)
+
+CONVERTERS = {
+	'scalar': lambda words: words[0] if words else '',
+	'array': lambda words: words,
+	# 'name: description' -> 'name'
+	'optdepends': lambda words: [w.split(':')[0].strip() for w in words]
+}
+
+# Fields a package_<name>() function of a split package may set for its own package
+OVERRIDES = (
+	'pkgdesc', 'arch', 'url', 'license', 'groups', 'depends', 'optdepends', 'provides',
+	'conflicts', 'replaces', 'backup', 'options', 'install', 'changelog'
+)
+
+# Function name -> PkgData field
+FUNCTIONS = {
+	'prepare': 'prepare_instructions',
+	'build': 'build_instructions',
+	'check': 'check_instructions',
+	'package': 'package_instructions'
+}
+
+
 class PkgSyntaxError(Exception):
 	def __init__(self, message = 'Syntax Error: incorrect PKGBUILD'):
 		super(PkgSyntaxError, self).__init__(message)
 
 class PkgData(object):
 	"""PkgData: class to manage and represent a PKGBUILD"""
+	__slots__ = (
+		'pkgbase', 'pkgname', 'pkgver', 'pkgrel', 'epoch', 'pkgdesc', 'arch', 'url',
+		'license', 'groups', 'depends', 'optdepends', 'makedepends', 'provides',
+		'conflicts', 'replaces', 'backup', 'options', 'install', 'changelog',
+		'source', 'noextract', 'validpgpkeys',
+		'md5sums', 'sha1sums', 'sha224sums', 'sha256sums', 'sha384sums', 'sha512sums', 'b2sums',
+		'prepare_instructions', 'build_instructions', 'check_instructions', 'package_instructions',
+		'variables', 'pkgnames', 'split_instructions', 'split_overrides'
+	)
+
 	def __init__(self):
 		super(PkgData, self).__init__()
 		self.pkgbase = ''
@@ -60,66 +136,105 @@ class PkgData(object):
 		self.source = []
 		self.noextract = []
 		self.validpgpkeys = []
-		self.checksum = ''
+		self.md5sums = []
+		self.sha1sums = []
+		self.sha224sums = []
+		self.sha256sums = []
+		self.sha384sums = []
+		self.sha512sums = []
+		self.b2sums = []
 
 		self.prepare_instructions = []
 		self.build_instructions = []
 		self.check_instructions = []
 		self.package_instructions = []
 
+		# Other top-level assignments, like _pkgname=foo: name -> string or list
+		self.variables = {}
+
+		# Split packages: every name in pkgname=(...), then the body of each
+		# package_<name>() function and the fields it sets
+		self.pkgnames = []
+		self.split_instructions = {}
+		self.split_overrides = {}
+
 
 	@staticmethod
-	def strip(s, substr):
-		if not substr.endswith('='):
-			substr += '='
+	def words(text, pos, array = False):
+		"""Split the shell words of a value starting at pos, honouring quotes and escapes
+
+		Stops at the end of the statement, or after the closing parenthesis
+		if array is set. Returns the words and the position reached."""
+		words = []
+		word = None
+		n = len(text)
+
+		while pos < n:
+			m = WORD_PART.match(text, pos)
+			if not m:
+				raise PkgSyntaxError('Syntax Error: unterminated quote or escape')
+
+			single, double, escaped, plain = m.group(1, 2, 3, 4)
+			token = m.group(0)
+
+			if token[0] == '#':
+				if word is None:
+					pos = m.end()
+					continue
 
-		s = s[len(substr):]
-		if s.endswith('\n'):
-			s = s[:-1]
+				# A '#' inside a word does not start a comment
+				m = PLAIN.match(text, pos)
+				plain = m.group(0)
 
-		if s.startswith('"') and s.endswith('"'):
-			s = s[1:-1]
+			if plain is not None:
+				word = (word or '') + plain
+			elif single is not None:
+				word = (word or '') + single
+			elif double is not None:
+				word = (word or '') + DOUBLE_ESCAPE.sub(lambda e: '' if e.group(1) == '\n' else e.group(1), double)
+			elif escaped is not None:
+				word = (word or '') + escaped
+			else:
+				# Word boundary: blanks, newline, ';' or ')'
+				if word is not None:
+					words.append(word)
+					word = None
 
-		return s
+				if token == ')':
+					return words, m.end()
 
+				if not array and token in ('\n', ';'):
+					return words, pos
 
-	@staticmethod
-	def striplist(s, field):
-		temp = PkgData.strip(s, field)
-		if temp.startswith('(') and temp.endswith(')'):
-			temp = temp[1:-1].replace("'", '')
+			pos = m.end()
 
-		return temp.split(' ')
+		if array:
+			raise PkgSyntaxError('Syntax Error: unterminated array')
 
+		if word is not None:
+			words.append(word)
 
-	@staticmethod
-	def getNextCharIndex(start, lines, char):
-		for i in range(start, len(lines)):
-			if lines[i].startswith(char):
-				return i
+		return words, pos
 
-		return None
 
 	@staticmethod
-	def stripfunction(name, start, lines):
-		if lines[start].startswith(name + '()' + ' {') or lines[start].startswith(name + '()' + '{'):
-			# start_index = start + 1
-			start += 1
+	def function_body(start, lines, brace):
+		"""Instruction lines of the function declared at lines[start], and the index following it"""
+		if not brace:
+			while start + 1 < len(lines) and not lines[start + 1].lstrip().startswith('{'):
+				start += 1
 
-		elif lines[start].startswith(name + '()'):
-			start = PkgData.getNextCharIndex(start, lines, '{') + 1
-
-		else:
-			raise PkgSyntaxError
+			start += 1
 
-		end = PkgData.getNextCharIndex(start + 1, lines, '}')
+		start += 1
+		end = start
+		while end < len(lines) and not lines[end].startswith('}'):
+			end += 1
 
-		if not start or not end:
+		if end >= len(lines):
 			raise PkgSyntaxError('Undefined behavior')
 
-		lines = [w.replace('\t', '').replace('\n', '') for w in lines[start:end]]
-
-		return lines
+		return [w.replace('\t', '') for w in lines[start:end]], end + 1
 
 
 	def print_debug(self):
@@ -146,115 +261,117 @@ class PkgData(object):
 		print("source: " + str(self.source))
 		print("noextract: " + str(self.noextract))
 		print("validpgpkeys: " + str(self.validpgpkeys))
-		print("checksum: " + self.checksum)
+		for field in ALGORITHMS:
+			if getattr(self, field):
+				print(field + ": " + str(getattr(self, field)))
 		print("\nprepare(): " + str(self.prepare_instructions))
 		print("build(): " + str(self.build_instructions))
 		print("check(): " + str(self.check_instructions))
 		print("package(): " + str(self.package_instructions))
+		for name, body in self.split_instructions.items():
+			print("package_{0}(): {1}".format(name, body))
+			if self.split_overrides.get(name):
+				print("  overrides: " + str(self.split_overrides[name]))
+		if self.variables:
+			print("\nvariables: " + str(self.variables))
 
 
-	def parse(self, filename):
-		"""Fetches every relevant information from a PKGBUILD"""
-		with open(filename, 'r') as file:
-			# for line in file:
-			lines = file.readlines()
-			for i in range(0, len(lines)):
-				line = lines[i]
-
-				if line.startswith('#'):
-					continue
+	def fields(self):
+		"""Every field, in __slots__ order"""
+		return tuple(getattr(self, f) for f in self.__slots__)
 
-				elif line.startswith('\n'):
-					continue
 
-				elif line.startswith('pkgbase=') and not self.pkgbase:
-					self.pkgbase = self.strip(line, 'pkgbase')
-				
-				elif line.startswith('pkgname=') and not self.pkgname:
-					self.pkgname = self.strip(line, 'pkgname')
+	@classmethod
+	def from_fields(cls, values):
+		"""Rebuild a PkgData from the output of fields()"""
+		pkgdata = cls.__new__(cls)
+		for f, v in zip(cls.__slots__, values):
+			setattr(pkgdata, f, v)
 
-				elif line.startswith('pkgver=') and not self.pkgver:
-					self.pkgver = self.strip(line, 'pkgver')
+		return pkgdata
 
-				elif line.startswith('pkgrel=') and not self.pkgrel:
-					self.pkgrel = self.strip(line, 'pkgrel')
 
-				elif line.startswith('pkgdesc=') and not self.pkgdesc:
-					self.pkgdesc = self.strip(line, 'pkgdesc')
-
-				elif line.startswith('arch=') and not self.arch:
-					self.arch = self.striplist(line, 'arch')
-
-				elif line.startswith('url=') and not self.url:
-					self.url = self.strip(line, 'url')
-
-				elif line.startswith('license=') and not self.license:
-					self.license = self.striplist(line, 'license')
-
-				elif line.startswith('groups=') and not self.groups:
-					self.groups = self.striplist(line, 'groups')
-
-				elif line.startswith('depends=') and not self.depends:
-					self.depends = self.striplist(line, 'depends')
-
-				elif line.startswith('optdepends=') and not self.optdepends:
-					tmplist = self.striplist(line, 'optdepends')
-
-					for i in tmplist:
-						if i.endswith(':'):
-							temp = i
-
-						if i == tmplist[-1] or tmplist[tmplist.index(i) + 1].endswith(':'):
-							self.optdepends.append(temp[:-1])
-
-				elif line.startswith('makedepends=') and not self.makedepends:
-					self.makedepends = self.striplist(line, 'makedepends')
-
-				elif line.startswith('provides=') and not self.provides:
-					self.provides = self.striplist(line, 'provides')
-
-				elif line.startswith('conflicts=') and not self.conflicts:
-					self.conflicts = self.striplist(line, 'conflicts')
-
-				elif line.startswith('replaces=') and not self.replaces:
-					self.replaces = self.striplist(line, 'replaces')
-
-				elif line.startswith('backup=') and not self.backup:
-					self.backup = self.striplist(line, 'backup')
+	def parse(self, filename):
+		"""Fetches every relevant information from a PKGBUILD in a single pass"""
+		with open(filename, 'r') as file:
+			self.parse_text(file.read())
+
+
+	def parse_text(self, text):
+		"""Same as parse(), for the content of a PKGBUILD"""
+		lines = text.split('\n')
+		offsets = [0]
+		offsets.extend(accumulate(len(line) + 1 for line in lines[:-1]))
+
+		i = 0
+		while i < len(lines):
+			line = lines[i]
+
+			m = ASSIGNMENT.match(line)
+			if m:
+				name, op = m.group(1), m.group(2)
+				pos = offsets[i] + m.end()
+				array = text.startswith('(', pos)
+				values, pos = self.words(text, pos + 1 if array else pos, array)
+
+				# Skip to the line following the statement, which may span several lines
+				i = bisect_right(offsets, pos - 1)
+
+				if name == 'pkgname' and not self.pkgnames:
+					self.pkgnames = values
+
+				kind = FIELDS.get(name)
+				if kind is None:
+					value = values if array else ' '.join(values)
+					if op == '+=' and name in self.variables:
+						value = self.variables[name] + value
+					self.variables[name] = value
+					continue
 
-				elif line.startswith('options=') and not self.options:
-					self.options = self.striplist(line, 'options')
+				value = CONVERTERS[kind](values)
+				if op == '+=' and kind != 'scalar':
+					setattr(self, name, getattr(self, name) + value)
+				elif not getattr(self, name):
+					setattr(self, name, value)
 
-				elif line.startswith('install=') and not self.install:
-					self.install = self.strip(line, 'install')
+				continue
 
-				elif line.startswith('changelog=') and not self.changelog:
-					self.changelog = self.strip(line, 'changelog')
+			m = FUNCTION.match(line)
+			if m:
+				body, next_line = self.function_body(i, lines, m.group(2))
+				field = FUNCTIONS.get(m.group(1))
+				if field and not getattr(self, field):
+					setattr(self, field, body)
 
-				elif line.startswith('source=') and not self.source:
-					self.source = self.striplist(line, 'source')
-					for i in self.source:
-						if i.startswith('"') and i.endswith('"'):
-							self.source[self.source.index(i)] = i[1:-1]
+				elif m.group(1).startswith('package_') and m.group(1)[8:] not in self.split_instructions:
+					name = m.group(1)[8:]
+					self.split_instructions[name] = body
+					fields = PkgData()
+					fields.parse_text('\n'.join(body))
+					self.split_overrides[name] = {f: getattr(fields, f) for f in OVERRIDES if getattr(fields, f)}
 
-				elif line.startswith('noextract=') and not self.noextract:
-					self.noextract = self.striplist(line, 'noextract')
+				i = next_line
+				continue
 
-				elif line.startswith('validpgpkeys=') and not self.validpgpkeys:
-					self.validpgpkeys = self.striplist(line, 'validpgpkeys')
+			i += 1
 
-				# Managing install instructions
-				elif line.startswith('prepare()') and not self.prepare_instructions:
-					self.prepare_instructions = self.stripfunction('prepare', i, lines)
+		for field in ALGORITHMS:
+			if getattr(self, field) and len(getattr(self, field)) != len(self.source):
+				raise PkgSyntaxError('{} does not have one entry per source'.format(field))
 
-				elif line.startswith('build()') and not self.build_instructions:
-					self.build_instructions = self.stripfunction('build', i, lines)
 
-				elif line.startswith('check()') and not self.check_instructions:
-					self.check_instructions = self.stripfunction('check', i, lines)
+	def split(self, name):
+		"""The PkgData of one package of a split PKGBUILD, with the fields its package function sets"""
+		pkgdata = self.from_fields(self.fields())
+		pkgdata.pkgname = name
+		pkgdata.pkgnames = [name]
+		pkgdata.package_instructions = self.split_instructions.get(name, self.package_instructions)
+		for field, value in self.split_overrides.get(name, {}).items():
+			setattr(pkgdata, field, value)
 
-				elif line.startswith('package()') and not self.package_instructions:
-					self.package_instructions = self.stripfunction('package', i, lines)
+		return pkgdata
 
 
-			print("IMPLEMENT CHECKSUM")
\ No newline at end of file
+	def checksums(self, index):
+		"""Expected digests of the index-th source, keyed by hashlib algorithm"""
+		return OrderedDict((algorithm, getattr(self, field)[index]) for field, algorithm in ALGORITHMS.items() if getattr(self, field))
\ No newline at end of file
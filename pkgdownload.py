@@ -30,49 +30,455 @@
 # SUCH DAMAGE.
 
 
-from urllib.request import urlopen
-from git import Repo as g
-from os.path import exists as path_exists
+from urllib.request import urlopen, Request
+from urllib.parse import urlsplit, unquote
+from urllib.error import HTTPError
+from email.utils import formatdate
+from json import load as json_load, dump as json_dump
+
+from checksum import MultiHash
+from srcbackends import FetchResult
+from tracing import human_size
+from httppool import ConnectionPool
+from mirrors import MirrorMap, MirrorRanker, FailoverStream, TRANSFER_ERRORS
+from extract import Extractor, PrefixedStream, detect_format, read_header, STREAM_FORMATS
+from os import remove, replace
+from os.path import exists as path_exists, basename, getmtime, getsize, isfile
+from tempfile import mkdtemp
+from shutil import rmtree
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import BoundedSemaphore, Lock
+from contextlib import nullcontext
+from time import monotonic, sleep
+import sys
+
+
+class StreamTee(object):
+	"""Read-only file object that copies what is read from stream to a hasher and an optional sink"""
+	def __init__(self, stream, hasher, sink = None, progress = None):
+		super(StreamTee, self).__init__()
+		self.__stream = stream
+		self.__hasher = hasher
+		self.__sink = sink
+		self.__progress = progress
+
+
+	def set_sink(self, sink):
+		self.__sink = sink
+
+
+	def read(self, size = -1):
+		data = self.__stream.read(size)
+		if data:
+			self.__hasher.update(data)
+			if self.__sink:
+				self.__sink.write(data)
+			if self.__progress:
+				self.__progress(len(data))
+
+		return data
+
+
+	def drain(self):
+		"""Consume whatever the reader left behind, e.g. tar end-of-archive padding"""
+		while self.read(1 << 16):
+			pass
+
+
+class DownloadProgress(object):
+	"""One status line for every transfer in progress, redrawn at most once per interval seconds
+
+	It is only drawn on a terminal: logs and pipes get the start and end of
+	each download from message() instead of a line per chunk. Without a
+	stream, it writes to whatever sys.stdout is at the time."""
+	def __init__(self, stream = None, interval = 0.25, enabled = None):
+		super(DownloadProgress, self).__init__()
+		self.__stream = stream
+		self.__interval = interval
+		self.__enabled = self.stream.isatty() if enabled is None else enabled
+		self.__transfers = {}
+		self.__drawn = False
+		self.__last = 0.
+		self.__lock = Lock()
+
+
+	@property
+	def stream(self):
+		return self.__stream or sys.stdout
+
+
+	def __line(self):
+		done = sum(d for d, t in self.__transfers.values())
+		totals = [t for d, t in self.__transfers.values()]
+		line = '[ Download ] {0} active, {1}'.format(len(self.__transfers), human_size(done))
+		if None not in totals:
+			total = sum(totals)
+			line += ' / {0} [{1:3.0f}%]'.format(human_size(total), done * 100. / total if total else 100.)
+
+		return line
+
+
+	def __draw(self):
+		if self.__transfers:
+			self.stream.write('\r\x1b[K' + self.__line())
+			self.__drawn = True
+		elif self.__drawn:
+			self.stream.write('\r\x1b[K')
+			self.__drawn = False
+
+		self.stream.flush()
+		self.__last = monotonic()
+
+
+	def message(self, text):
+		"""Print a line of its own, above the status line"""
+		with self.__lock:
+			if self.__drawn:
+				self.stream.write('\r\x1b[K')
+				self.__drawn = False
+			self.stream.write(text + '\n')
+			if self.__enabled and self.__transfers:
+				self.__draw()
+
+
+	def start(self, name, done, total):
+		with self.__lock:
+			self.__transfers[name] = (done, total)
+
+
+	def update(self, name, n):
+		with self.__lock:
+			done, total = self.__transfers[name]
+			self.__transfers[name] = (done + n, total)
+			if self.__enabled and monotonic() - self.__last >= self.__interval:
+				self.__draw()
+
+
+	def finish(self, name):
+		with self.__lock:
+			self.__transfers.pop(name, None)
+			if self.__enabled:
+				self.__draw()
+
+
+class RateLimiter(object):
+	"""Bandwidth limit shared by concurrent transfers, in bytes per second
+
+	Each transfer reports the bytes it received and sleeps until the limit
+	has paid for them, so the overall rate stays below the limit."""
+	def __init__(self, rate):
+		super(RateLimiter, self).__init__()
+		self.rate = rate
+		self.__next = monotonic()
+		self.__lock = Lock()
+
+
+	def consume(self, n):
+		with self.__lock:
+			now = monotonic()
+			self.__next = max(self.__next, now) + n / float(self.rate)
+			delay = self.__next - now
+
+		if delay > 0:
+			sleep(delay)
 
 
 class PkgDownloadManager(object):
 	"""Simple Download Manager class"""
-	def __init__(self, rootdir):
+	def __init__(self, rootdir, jobs = 4, per_host = 2, cache = None, tracer = None, mirrors = None, buffer_size = 1 << 18, rate_limit = None, progress = None):
 		super(PkgDownloadManager, self).__init__()
 		self.__rootdir = rootdir
+		self.__cache = cache
+		self.__tracer = tracer
+		self.__buffer_size = max(1 << 12, buffer_size)
+		self.__limiter = RateLimiter(rate_limit) if rate_limit else None
+		self.__progress = progress or DownloadProgress()
+		self.__pool = ConnectionPool(max(1, per_host))
+		self.__mirrors = mirrors or MirrorMap()
+		self.__ranker = MirrorRanker(self.open, jobs)
+		self.__meta_path = rootdir + '/.downloads.json'
+		self.__meta_lock = Lock()
+		self.__digests = {}
+		self.__extracted = {}
+		self.__jobs = max(1, jobs)
+		self.__per_host = max(1, per_host)
+		self.__host_slots = {}
+		self.__host_lock = Lock()
+
+
+	def __host_slot(self, url):
+		host = urlsplit(self.source_url(url)).netloc
+		with self.__host_lock:
+			if host not in self.__host_slots:
+				self.__host_slots[host] = BoundedSemaphore(self.__per_host)
+
+			return self.__host_slots[host]
+
+
+	def __fetch(self, url, algorithms, extract_to, noextract, keep):
+		with self.__host_slot(url), (self.__tracer.span('download ' + self.url_filename(url), 'download', url=url) if self.__tracer else nullcontext()) as span:
+			try:
+				filename = self.get(url, algorithms, extract_to if url not in noextract else None, noextract, keep)
+				if span and isfile(self.__rootdir + '/' + filename):
+					span.bytes = getsize(self.__rootdir + '/' + filename)
+				extracted, members = self.__extracted.get(filename, (None, None))
+				return FetchResult(url, filename, digests=self.streamed_digests(filename), extracted=extracted, members=members)
+			except Exception as e:
+				return FetchResult(url, error=e)
+
+
+	@staticmethod
+	def interleave_hosts(sources):
+		"""Reorder sources round-robin by host, so that per-host limits block as few workers as possible"""
+		queues = {}
+		for url in sources:
+			queues.setdefault(urlsplit(PkgDownloadManager.source_url(url)).netloc, []).append(url)
+
+		ordered = []
+		while queues:
+			for host in list(queues):
+				ordered.append(queues[host].pop(0))
+				if not queues[host]:
+					del queues[host]
+
+		return ordered
+
+
+	def fetch_all(self, sources, algorithms = (), extract_to = None, noextract = (), keep = True):
+		"""Download every url in sources concurrently, yielding a FetchResult as soon as each one completes
 
+		See get() for the meaning of extract_to and keep."""
+		with ThreadPoolExecutor(max_workers=self.__jobs) as pool:
+			futures = [pool.submit(self.__fetch, url, algorithms, extract_to, noextract, keep) for url in self.interleave_hosts(sources)]
+			for future in as_completed(futures):
+				yield future.result()
 
-	def get(self, url):
-		"""Simple HTTP/GET request with progress bar to retrieve a file"""
+		self.__pool.close()
+
+
+	def open(self, url, headers = None):
+		"""GET url, through a kept-alive connection for http and https"""
+		if ConnectionPool.supports(url):
+			return self.__pool.open(url, headers)
+
+		return urlopen(Request(url, headers=headers or {}))
+
+
+	def locations(self, url):
+		"""url and its mirrors, fastest first"""
+		return self.__ranker.rank(self.__mirrors.locations(url))
+
+
+	def __open_location(self, locations, headers):
+		"""Response of the first location that answers, with the locations left to fail over to
+
+		Not modified and range errors are answers, and are raised as they are."""
+		for i, location in enumerate(locations):
+			try:
+				return self.open(location, headers), locations[i + 1:]
+			except HTTPError as e:
+				if e.code in (304, 416) or i == len(locations) - 1:
+					raise
+				self.__progress.message('[ Mirror ] {0}: {1}'.format(location, e))
+			except TRANSFER_ERRORS as e:
+				if i == len(locations) - 1:
+					raise
+				self.__progress.message('[ Mirror ] {0}: {1}'.format(location, e))
+
+
+	@staticmethod
+	def source_url(source):
+		"""The url of a [name::]url source"""
+		return source.rpartition('::')[2]
+
+
+	@staticmethod
+	def url_filename(url):
+		"""The name of a name::url source, or a guess from the last path component of url"""
+		name, sep, url = url.rpartition('::')
+		if name:
+			return name
+
+		name = basename(unquote(urlsplit(url).path))
+		return name if name else urlsplit(url).netloc
+
+
+	def __load_meta(self):
+		if not isfile(self.__meta_path):
+			return {}
+
+		with open(self.__meta_path, 'r') as f:
+			return json_load(f)
+
+
+	def __update_meta(self, url, entry):
+		"""Remember validators of url, so that the next fetch can be conditional or resumed"""
+		with self.__meta_lock:
+			meta = self.__load_meta()
+			meta[url] = entry
+			with open(self.__meta_path, 'w') as f:
+				json_dump(meta, f, indent=1)
+
+
+	def streamed_digests(self, filename):
+		"""Digests computed while filename was being downloaded, or None if it was not transferred"""
+		return self.__digests.get(filename)
+
+
+	def get(self, url, algorithms = (), extract_to = None, noextract = (), keep = True):
+		"""HTTP/GET request with progress bar to retrieve a file, resuming partial and skipping unchanged downloads
+
+		The file is hashed with every algorithm in algorithms while it is written,
+		see streamed_digests(). If extract_to is set, a tarball (or compressed
+		file) not listed in noextract that is transferred in full is extracted
+		from the network stream into a staging directory below extract_to, in
+		the same pass; the archive itself is only written to disk if keep is set."""
 		# Progress bar thanks to https://stackoverflow.com/questions/22676/how-do-i-download-a-file-over-http-using-python
-		u = urlopen(url)
-		meta = u.info()
-		filename = meta['Content-Disposition'][meta['Content-Disposition'].find('filename=') + 9:]    # Translating index of 'filename='.size()
+		if self.__cache:
+			filename = self.__cache.lookup(url, self.__rootdir)
+			if filename:
+				self.__progress.message('[ Cache ] {}'.format(filename))
+				return filename
 
-		if path_exists(self.__rootdir + '/' + filename):
-			return filename
+		with self.__meta_lock:
+			meta = self.__load_meta().get(url, {})
 
-		with open(self.__rootdir + '/' + filename, 'wb') as f:
-			filesize = int(meta['Content-Length'])
+		filename = meta.get('filename') or self.url_filename(url)
+		path = self.__rootdir + '/' + filename
+		part_path = path + '.part'
+		offset = 0
+		headers = {}
 
-			print('[ Download ] {0}: {1} Bytes'.format(filename, filesize))
+		if path_exists(path):
+			if meta.get('etag'):
+				headers['If-None-Match'] = meta['etag']
 
+			headers['If-Modified-Since'] = meta.get('last_modified') or formatdate(getmtime(path), usegmt=True)
+
+		elif path_exists(part_path) and meta:
+			offset = getsize(part_path)
+			if offset:
+				headers['Range'] = 'bytes={}-'.format(offset)
+				if meta.get('etag') or meta.get('last_modified'):
+					headers['If-Range'] = meta.get('etag') or meta.get('last_modified')
+
+		try:
+			u, alternatives = self.__open_location(self.locations(self.source_url(url)), headers)
+
+		except HTTPError as e:
+			if e.code == 304:
+				self.__progress.message('[ Download ] {}: not modified'.format(filename))
+				if self.__cache:
+					self.__cache.store(url, path)
+
+				return filename
+
+			if e.code == 416 and offset:
+				# The partial file does not match the remote one anymore
+				remove(part_path)
+				return self.get(url, algorithms, extract_to, noextract, keep)
+
+			raise
+
+		info = u.info()
+
+		if u.status == 206:
+			filesize_dl = offset
+		else:
 			filesize_dl = 0
-			blocksz = 8192
+			filename = url.rpartition('::')[0] or info.get_filename() or self.url_filename(u.geturl())
+			path = self.__rootdir + '/' + filename
+			part_path = path + '.part'
+
+		self.__update_meta(url, {
+			'filename': filename,
+			'etag': info['ETag'],
+			'last_modified': info['Last-Modified']
+		})
+
+		filesize = int(info['Content-Length']) + filesize_dl if info['Content-Length'] else None
+		hasher = MultiHash(algorithms)
+
+		if filesize_dl:
+			with open(part_path, 'rb') as f:
+				for block in iter(lambda: f.read(1 << 20), b''):
+					hasher.update(block)
+
+		received = 0
+
+		def progress(n):
+			nonlocal received
+			received += n
+			self.__progress.update(filename, n)
+			if self.__limiter:
+				self.__limiter.consume(n)
+
+		self.__progress.message('[ Download ] {0}: {1} Bytes'.format(filename, filesize if filesize is not None else 'unknown'))
+		self.__progress.start(filename, filesize_dl, filesize)
+		start = monotonic()
+
+		# The rest of the file comes from the next location if this one breaks off
+		stream = FailoverStream(u, alternatives, self.open, filesize_dl, filesize, filename, self.__progress.message)
+		try:
+			header = b''
+			streaming = extract_to and not filesize_dl and filename not in noextract
+			if streaming:
+				# The format is told by magic bytes, which also go through the hasher
+				tee = StreamTee(stream, hasher, None, progress)
+				header = read_header(tee)
+				streaming = detect_format(header) in STREAM_FORMATS
+
+			if streaming:
+				f = open(part_path, 'wb') if keep else None
+				staging = mkdtemp(prefix='.extract-', dir=extract_to)
+
+				try:
+					if f:
+						f.write(header)
+						tee.set_sink(f)
+
+					members = Extractor.extract_stream(PrefixedStream(header, tee), filename, staging)
+					tee.drain()
+				except:
+					rmtree(staging)
+					raise
+				finally:
+					if f:
+						f.close()
+
+				self.__extracted[filename] = (staging, members)
+
+			else:
+				# One buffer for the whole transfer: every chunk is read into it, then written
+				# and hashed through a view, without allocating a bytes object per chunk.
+				# Under a rate limit, chunks are kept to a fraction of a second of transfer.
+				size = self.__buffer_size
+				if self.__limiter:
+					size = max(1 << 12, min(size, self.__limiter.rate // 4))
+				buffer = memoryview(bytearray(size))
+
+				with open(part_path, 'ab' if filesize_dl else 'wb') as f:
+					f.write(header)
+
+					n = stream.readinto(buffer)
+					while n:
+						f.write(buffer[:n])
+						hasher.update(buffer[:n])
+						progress(n)
+						n = stream.readinto(buffer)
+		finally:
+			stream.close()
+			self.__progress.finish(filename)
+
+		elapsed = max(monotonic() - start, 1e-6)
+		self.__progress.message('[ Download ] {0}: {1} in {2:.2f}s ({3}/s)'.format(filename, human_size(received), elapsed, human_size(int(received / elapsed))))
 
-			buffer = u.read(blocksz)
-			while buffer:
-				filesize_dl += len(buffer)
-				f.write(buffer)
-				status = r"%10d  [%3.2f%%]" % (filesize_dl, filesize_dl * 100. / filesize)
+		self.__digests[filename] = hasher.hexdigests()
 
-				print(status)
-				buffer = u.read(blocksz)
+		if path_exists(part_path):
+			replace(part_path, path)
 
-			return filename
-			
+			if self.__cache:
+				self.__cache.store(url, path, self.__digests[filename].get('sha256'))
 
-	def git(self, url):
-		"""Simple git clone method"""
-		path = self.__rootdir + url.split('/')[-1]
-		g.clone_from(url, path)
\ No newline at end of file
+		return filename
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os import scandir, readlink, stat
+from stat import S_ISREG, S_ISDIR, S_ISLNK, S_IMODE
+from collections import OrderedDict
+from hashlib import sha256
+from json import dumps as json_dumps
+
+from checksum import hash_files
+
+
+class FileEntry(object):
+	"""Metadata of one path of a package tree"""
+	__slots__ = ('path', 'stat', 'md5', 'target')
+
+	def __init__(self, path, stat, md5 = None, target = None):
+		super(FileEntry, self).__init__()
+		self.path = path
+		self.stat = stat
+		self.md5 = md5
+		self.target = target
+
+
+	@property
+	def kind(self):
+		if S_ISREG(self.stat.st_mode):
+			return 'f'
+		if S_ISDIR(self.stat.st_mode):
+			return 'd'
+		if S_ISLNK(self.stat.st_mode):
+			return 'l'
+
+		return 'o'
+
+
+class PkgScan(object):
+	"""One walk of a package tree, hashing its files on a thread pool
+
+	entries maps the path of everything in pkgdir except DEBIAN, relative
+	and in the order dpkg-deb would archive it, to a FileEntry. The scan gives
+	DEBIAN/md5sums, Installed-Size, the members of data.tar and a fingerprint
+	of the content for incremental builds."""
+	def __init__(self, pkgdir, jobs = None):
+		super(PkgScan, self).__init__()
+		self.pkgdir = pkgdir
+		self.entries = OrderedDict()
+		# pkgdir itself may be a symlink, to a tree kept on tmpfs
+		self.entries['.'] = FileEntry('.', stat(pkgdir))
+		self.__walk(pkgdir, '.', ('DEBIAN',))
+
+		files = [e for e in self.entries.values() if e.kind == 'f']
+		digests = hash_files([pkgdir + e.path[1:] for e in files], ('md5',), jobs)
+		for e in files:
+			e.md5 = digests[pkgdir + e.path[1:]]['md5']
+
+
+	def __walk(self, directory, relative, exclude = ()):
+		for entry in sorted(scandir(directory), key=lambda e: e.name):
+			if entry.name in exclude:
+				continue
+
+			path = relative + '/' + entry.name
+			st = entry.stat(follow_symlinks=False)
+			self.entries[path] = FileEntry(path, st, target=readlink(entry.path) if S_ISLNK(st.st_mode) else None)
+
+			if S_ISDIR(st.st_mode):
+				self.__walk(entry.path, path)
+
+
+	@property
+	def installed_size(self):
+		"""Installed-Size in KiB, counted like dpkg-gencontrol: files rounded up, everything else as 1"""
+		total = 0
+		inodes = set()
+		for e in self.entries.values():
+			if e.path == '.':
+				continue
+
+			if e.kind == 'f':
+				if e.stat.st_nlink > 1:
+					if (e.stat.st_dev, e.stat.st_ino) in inodes:
+						continue
+					inodes.add((e.stat.st_dev, e.stat.st_ino))
+				total += (e.stat.st_size + 1023) // 1024
+			else:
+				total += 1
+
+		return total
+
+
+	@property
+	def size(self):
+		return sum(e.stat.st_size for e in self.entries.values() if e.kind == 'f')
+
+
+	def md5sums(self):
+		"""Content of DEBIAN/md5sums"""
+		return ''.join('{0}  {1}\n'.format(e.md5, e.path[2:]) for e in self.entries.values() if e.kind == 'f')
+
+
+	def write_md5sums(self, path):
+		with open(path, 'w') as f:
+			f.write(self.md5sums())
+
+
+	def fingerprint(self):
+		"""Digest of the paths, types, modes and contents of the tree, ignoring timestamps"""
+		state = [(e.path, e.kind, S_IMODE(e.stat.st_mode), e.md5, e.target) for e in self.entries.values()]
+		return sha256(json_dumps(state).encode()).hexdigest()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os import scandir
+from os.path import join as path_join, relpath, isfile, basename
+from io import BytesIO
+from time import gmtime, strftime
+from json import load as json_load, dumps as json_dumps
+from hashlib import new as hash_new
+import gzip
+import lzma
+import tarfile
+
+from checksum import MultiHash
+from control import ControlData
+from extract import decompress
+from srccache import link_or_copy
+from fileutil import atomic_write
+
+
+# Digests listed in Packages and Release: Packages field name -> hashlib name
+DIGESTS = (('MD5sum', 'md5'), ('SHA1', 'sha1'), ('SHA256', 'sha256'))
+RELEASE_DIGESTS = (('MD5Sum', 'md5'), ('SHA1', 'sha1'), ('SHA256', 'sha256'))
+
+# Suffix of the control member -> extract.decompress() format
+CONTROL_FORMATS = {'': None, '.gz': 'gz', '.xz': 'xz', '.zst': 'zst', '.bz2': 'bz2'}
+
+
+class RepoError(Exception):
+	def __init__(self, message = 'Repo Error: invalid package'):
+		super(RepoError, self).__init__(message)
+
+
+def read_deb(path):
+	"""Control data and digests of a .deb, read in a single pass over the file"""
+	hasher = MultiHash([a for f, a in DIGESTS])
+	control = None
+
+	def read(f, size):
+		data = f.read(size)
+		if len(data) != size:
+			raise RepoError('{}: truncated ar archive'.format(path))
+		hasher.update(data)
+		return data
+
+	with open(path, 'rb') as f:
+		if read(f, 8) != b'!<arch>\n':
+			raise RepoError('{}: not an ar archive'.format(path))
+
+		while True:
+			header = f.read(60)
+			if not header:
+				break
+			if len(header) != 60:
+				raise RepoError('{}: truncated ar archive'.format(path))
+			hasher.update(header)
+
+			name = header[:16].decode().strip().rstrip('/')
+			size = int(header[48:58])
+			if name.startswith('control.tar') and control is None:
+				suffix = name[len('control.tar'):]
+				if suffix not in CONTROL_FORMATS:
+					raise RepoError('{0}: unsupported {1}'.format(path, name))
+
+				stream = decompress(BytesIO(read(f, size)), CONTROL_FORMATS[suffix]) if CONTROL_FORMATS[suffix] else BytesIO(read(f, size))
+				with tarfile.open(fileobj=BytesIO(stream.read()), mode='r:') as tar:
+					for member in tar:
+						if member.isfile() and member.name.lstrip('./') == 'control':
+							control = ControlData.loads(tar.extractfile(member).read().decode())
+							break
+			else:
+				remaining = size
+				while remaining:
+					remaining -= len(read(f, min(remaining, 1 << 20)))
+
+			# Members are aligned on 2 bytes
+			if size % 2:
+				read(f, 1)
+
+	if control is None:
+		raise RepoError('{}: no control file'.format(path))
+
+	return control, hasher.hexdigests()
+
+
+class Repository(object):
+	"""A flat APT repository: the .deb files of a directory, with Packages and Release
+
+	Stanzas are kept in directory/.index.json, keyed by the path of each
+	package and checked against its size and mtime, so that only packages
+	added or changed since the last update are read."""
+	def __init__(self, directory):
+		super(Repository, self).__init__()
+		self.__directory = directory
+		self.__index_path = path_join(directory, '.index.json')
+		self.__index = {}
+		self.read = []
+		self.removed = []
+
+		if isfile(self.__index_path):
+			with open(self.__index_path, 'r') as f:
+				self.__index = json_load(f)
+
+
+	def __debs(self, directory):
+		for entry in scandir(directory):
+			if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.'):
+				yield from self.__debs(entry.path)
+			elif entry.name.endswith('.deb') and entry.is_file():
+				yield entry.path, entry.stat()
+
+
+	def add(self, paths):
+		"""Place the given .deb files in the repository, without copying their data when possible"""
+		for path in paths:
+			link_or_copy(path, path_join(self.__directory, basename(path)))
+
+
+	def update(self):
+		"""Refresh the index, returning True if any package was added, changed or removed"""
+		found = {}
+		for path, st in self.__debs(self.__directory):
+			name = relpath(path, self.__directory)
+			entry = self.__index.get(name)
+
+			if entry is None or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+				control, digests = read_deb(path)
+				stanza = control.dumps() + 'Filename: ./{0}\nSize: {1}\n'.format(name, st.st_size)
+				stanza += ''.join('{0}: {1}\n'.format(field, digests[a]) for field, a in DIGESTS)
+				entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': digests['sha256'],
+					'package': control.package, 'version': control.version, 'stanza': stanza}
+				self.read.append(name)
+
+			found[name] = entry
+
+		self.removed = sorted(set(self.__index) - set(found))
+		changed = bool(self.read or self.removed) or not isfile(path_join(self.__directory, 'Release'))
+		self.__index = found
+
+		if changed:
+			with atomic_write(self.__index_path, 'wb') as f:
+				f.write(json_dumps(found, indent=1).encode())
+
+		return changed
+
+
+	def packages(self):
+		"""Content of the Packages file, sorted by package name and path"""
+		entries = sorted(self.__index.items(), key=lambda e: (e[1]['package'], e[0]))
+		return '\n'.join(e['stanza'] for n, e in entries).encode()
+
+
+	def write(self, origin = None, label = None):
+		"""Rewrite Packages, Packages.gz, Packages.xz and Release"""
+		packages = self.packages()
+		files = [
+			('Packages', packages),
+			('Packages.gz', gzip.compress(packages, 9, mtime=0)),
+			('Packages.xz', lzma.compress(packages, preset=6))
+		]
+
+		for name, data in files:
+			with atomic_write(path_join(self.__directory, name), 'wb') as f:
+				f.write(data)
+
+		release = []
+		if origin:
+			release.append('Origin: {}'.format(origin))
+		if label:
+			release.append('Label: {}'.format(label))
+		release.append('Date: {}'.format(strftime('%a, %d %b %Y %H:%M:%S UTC', gmtime())))
+
+		for field, algorithm in RELEASE_DIGESTS:
+			release.append(field + ':')
+			for name, data in files:
+				release.append(' {0} {1:>16} {2}'.format(hash_new(algorithm, data).hexdigest(), len(data), name))
+
+		with atomic_write(path_join(self.__directory, 'Release'), 'wb') as f:
+			f.write(('\n'.join(release) + '\n').encode())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os import read as os_read, environ, makedirs, remove
+from sys import stdout, stderr
+from shlex import quote
+from subprocess import Popen, PIPE, STDOUT
+from threading import Thread
+from queue import Queue
+from time import monotonic
+import re
+
+
+NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+
+# Chunks of output waiting to be written: the build blocks when the console can not keep up
+QUEUE_SIZE = 64
+CHUNK_SIZE = 1 << 16
+
+
+class StageResult(object):
+	"""Outcome of a build stage"""
+	def __init__(self, stage, returncode, duration, log):
+		super(StageResult, self).__init__()
+		self.stage = stage
+		self.returncode = returncode
+		self.duration = duration
+		self.log = log
+
+
+	@property
+	def ok(self):
+		return self.returncode == 0
+
+
+def shell_assignment(name, value):
+	"""Bash statement declaring name, exported unless it is an array"""
+	if isinstance(value, (list, tuple)):
+		return '{0}=({1})'.format(name, ' '.join(quote(str(v)) for v in value))
+
+	return 'export {0}={1}'.format(name, quote(str(value)))
+
+
+class StageRunner(object):
+	"""Runs the body of each PKGBUILD function as one bash -e script
+
+	Every PKGBUILD variable is declared at the top of the script, and the
+	script starts in srcdir, like makepkg does. Output is copied to the
+	console and to <logprefix>-<stage>.log as it is produced."""
+	def __init__(self, variables, srcdir, logprefix):
+		super(StageRunner, self).__init__()
+		self.__srcdir = srcdir
+		self.__logprefix = logprefix
+		self.__header = ['set -e']
+		self.__header.extend(shell_assignment(n, v) for n, v in variables.items() if NAME.match(n))
+		self.results = []
+
+
+	def script(self, instructions, overrides = None):
+		"""The script for instructions; overrides replaces some variables, like pkgdir for a split package"""
+		lines = list(self.__header)
+		for name, value in (overrides or {}).items():
+			lines.extend(['unset ' + name, shell_assignment(name, value)])
+
+		return '\n'.join(lines + ['cd ' + quote(self.__srcdir)] + list(instructions)) + '\n'
+
+
+	@staticmethod
+	def __pump(fd, chunks):
+		while True:
+			data = os_read(fd, CHUNK_SIZE)
+			chunks.put(data)
+			if not data:
+				break
+
+
+	def run(self, stage, instructions, overrides = None, prefix = None, logprefix = None):
+		"""Run instructions, returning a StageResult
+
+		With prefix set, every line printed on the console starts with it, so
+		that stages running at the same time can be told apart. logprefix
+		replaces the one of the runner, e.g. for each package of a split
+		PKGBUILD."""
+		makedirs(self.__srcdir, exist_ok=True)
+		log_path = '{0}-{1}.log'.format(logprefix or self.__logprefix, stage)
+		script_path = '{0}-{1}.sh'.format(logprefix or self.__logprefix, stage)
+
+		with open(script_path, 'w') as f:
+			f.write(self.script(instructions, overrides))
+
+		start = monotonic()
+		chunks = Queue(QUEUE_SIZE)
+		out = stdout.buffer
+
+		stdout.flush()
+		with open(log_path, 'wb') as log:
+			proc = Popen(['bash', '-e', script_path], stdout=PIPE, stderr=STDOUT, cwd=self.__srcdir, env=environ.copy())
+			pump = Thread(target=self.__pump, args=(proc.stdout.fileno(), chunks), daemon=True)
+			pump.start()
+
+			pending = b''
+			while True:
+				data = chunks.get()
+				if not data:
+					break
+
+				log.write(data)
+				if prefix is None:
+					out.write(data)
+					out.flush()
+					continue
+
+				lines = (pending + data).split(b'\n')
+				pending = lines.pop()
+				if lines:
+					out.write(b''.join(prefix.encode() + line + b'\n' for line in lines))
+					out.flush()
+
+			if pending:
+				out.write(prefix.encode() + pending + b'\n')
+				out.flush()
+
+			pump.join()
+			proc.stdout.close()
+			returncode = proc.wait()
+
+		remove(script_path)
+
+		result = StageResult(stage, returncode, monotonic() - start, log_path)
+		self.results.append(result)
+		return result
+
+
+	@staticmethod
+	def print_result(result):
+		if result.ok:
+			print('[ {0}() ] done in {1:.2f}s'.format(result.stage, result.duration))
+		else:
+			print('[ {0}() ] failed with exit status {1} after {2:.2f}s, see {3}'.format(
+				result.stage, result.returncode, result.duration, result.log), file=stderr)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os import walk, cpu_count
+from os.path import isdir, isfile, dirname, basename, realpath, join as path_join
+from subprocess import run as run_cmd, STDOUT
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from heapq import heappush, heappop
+from collections import OrderedDict
+from json import load as json_load, dump as json_dump
+from time import time
+from re import split as re_split
+
+from pkgdata import PkgData
+from fileutil import atomic_write
+
+
+def find_pkgbuilds(paths):
+	"""Expand directories into the PKGBUILD files found below them, each listed once"""
+	found = []
+	for path in paths:
+		if isdir(path):
+			for dirpath, dirnames, filenames in walk(path):
+				dirnames.sort()
+				if 'PKGBUILD' in filenames:
+					found.append(path_join(dirpath, 'PKGBUILD'))
+		else:
+			found.append(path)
+
+	return list(OrderedDict.fromkeys(realpath(p) for p in found))
+
+
+def dependency_name(dep):
+	"""Strip the version constraint from a depends/provides entry"""
+	return re_split('[<>=]', dep, 1)[0]
+
+
+class BuildJob(object):
+	"""A PKGBUILD scheduled by BuildScheduler"""
+	def __init__(self, path, pkgdata):
+		super(BuildJob, self).__init__()
+		self.path = path
+		self.pkgdata = pkgdata
+		self.deps = set()
+		self.dependents = set()
+		self.priority = 0
+		self.status = 'pending'
+		self.reason = ''
+		self.duration = 0.
+
+
+class BuildScheduler(object):
+	"""Builds many PKGBUILDs in dependency order on a pool of workers
+
+	Jobs are ordered by their critical path: the longest chain of work
+	(weighted by the duration of the previous run, when known) that waits
+	on them. A failed build only skips the packages depending on it.
+
+	A package is built after the ones it depends on, but they are only
+	installed if -i is passed on: otherwise its dependency check fails,
+	unless they were installed already."""
+	def __init__(self, paths, command, workers = None, times_path = '.makedebpkg-batch.json', cache = None):
+		super(BuildScheduler, self).__init__()
+		self.__command = command
+		self.__workers = workers or cpu_count()
+		self.__times_path = times_path
+		self.__times = {}
+		self.jobs = []
+
+		if isfile(times_path):
+			with open(times_path, 'r') as f:
+				self.__times = json_load(f)
+
+		for path in find_pkgbuilds(paths):
+			try:
+				if cache:
+					job = BuildJob(path, cache.load(path))
+				else:
+					job = BuildJob(path, PkgData())
+					job.pkgdata.parse(path)
+
+			except Exception as e:
+				job = BuildJob(path, PkgData())
+				job.pkgdata.pkgname = basename(dirname(path))
+				job.status = 'failed'
+				job.reason = 'cannot parse PKGBUILD: {}'.format(e)
+
+			self.jobs.append(job)
+
+		if cache:
+			cache.save()
+
+		self.__link()
+		self.__prioritise()
+
+
+	def __link(self):
+		providers = {}
+		for job in self.jobs:
+			for name in (job.pkgdata.pkgnames or [job.pkgdata.pkgname]) + [dependency_name(p) for p in job.pkgdata.provides if p]:
+				providers.setdefault(name, job)
+
+		for job in self.jobs:
+			for dep in job.pkgdata.depends + job.pkgdata.makedepends:
+				provider = providers.get(dependency_name(dep)) if dep else None
+				if provider and provider is not job:
+					job.deps.add(provider)
+					provider.dependents.add(job)
+
+
+	def __prioritise(self):
+		"""Compute critical path lengths; jobs left out of the topological order sit on a dependency cycle"""
+		remaining = {j: len(j.deps) for j in self.jobs}
+		order = [j for j in self.jobs if not j.deps]
+		for job in order:
+			for d in job.dependents:
+				remaining[d] -= 1
+				if remaining[d] == 0:
+					order.append(d)
+
+		for job in self.jobs:
+			if remaining[job] and job.status == 'pending':
+				job.status = 'failed'
+				job.reason = 'dependency cycle'
+
+		for job in reversed(order):
+			job.priority = self.__times.get(job.path, 1.) + max([d.priority for d in job.dependents] or [0.])
+
+
+	def __skip_dependents(self, job):
+		for d in job.dependents:
+			if d.status == 'pending':
+				d.status = 'skipped'
+				d.reason = '{} did not build'.format(job.pkgdata.pkgname)
+				self.__skip_dependents(d)
+
+
+	def __build(self, job):
+		start = time()
+		with open(path_join(dirname(job.path), 'makedebpkg.log'), 'w') as log:
+			returncode = run_cmd(self.__command + [basename(job.path)], cwd=dirname(job.path), stdout=log, stderr=STDOUT).returncode
+
+		job.duration = time() - start
+		return returncode
+
+
+	def __save_times(self):
+		self.__times.update((j.path, j.duration) for j in self.jobs if j.status == 'built')
+		with atomic_write(self.__times_path) as f:
+			json_dump(self.__times, f, indent=1)
+
+
+	def run(self):
+		"""Build every job, returning True if all of them succeeded"""
+		for job in [j for j in self.jobs if j.status == 'failed']:
+			self.__skip_dependents(job)
+
+		ready = []
+		waiting = {j: len(j.deps) for j in self.jobs if j.status == 'pending'}
+		for job in waiting:
+			if not job.deps:
+				heappush(ready, (-job.priority, job.path, job))
+
+		with ThreadPoolExecutor(max_workers=self.__workers) as pool:
+			running = {}
+			while ready or running:
+				while ready and len(running) < self.__workers:
+					job = heappop(ready)[2]
+					if job.status != 'pending':
+						continue
+
+					job.status = 'building'
+					print('[ Batch ] building {}'.format(job.pkgdata.pkgname))
+					running[pool.submit(self.__build, job)] = job
+
+				if not running:
+					break
+
+				done, pending = wait(running, return_when=FIRST_COMPLETED)
+				for future in done:
+					job = running.pop(future)
+
+					if future.result() == 0:
+						job.status = 'built'
+						print('[ Batch ] {0}: built in {1:.1f}s'.format(job.pkgdata.pkgname, job.duration))
+
+						for d in job.dependents:
+							# Jobs failed or skipped before the run started are not waited for
+							if d not in waiting or d.status != 'pending':
+								continue
+
+							waiting[d] -= 1
+							if waiting[d] == 0:
+								heappush(ready, (-d.priority, d.path, d))
+					else:
+						job.status = 'failed'
+						job.reason = 'exit status {0}, see {1}'.format(future.result(), path_join(dirname(job.path), 'makedebpkg.log'))
+						print('[ Batch ] {0}: failed'.format(job.pkgdata.pkgname))
+						self.__skip_dependents(job)
+
+		self.__save_times()
+
+		return all(j.status == 'built' for j in self.jobs)
+
+
+	def print_summary(self):
+		print('\n[ Batch summary ]')
+		for job in sorted(self.jobs, key=lambda j: (j.status, j.pkgdata.pkgname)):
+			print('{0:<8} {1:<30} {2}'.format(job.status, job.pkgdata.pkgname, job.reason or '{:.1f}s'.format(job.duration)))
+
+		counts = {}
+		for job in self.jobs:
+			counts[job.status] = counts.get(job.status, 0) + 1
+
+		print(', '.join('{0} {1}'.format(n, s) for s, n in sorted(counts.items())))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+
+from importlib import import_module
+from collections import OrderedDict
+
+
+# Backend handling each source scheme; plain paths are given the local scheme
+SCHEMES = {
+	'http': 'http',
+	'https': 'http',
+	'ftp': 'http',
+	'file': 'local',
+	'local': 'local',
+	'git': 'git'
+}
+
+# Module implementing each backend, imported the first time a source needs it
+BACKENDS = {
+	'http': 'pkgdownload',
+	'local': 'localsource',
+	'git': 'gitcache'
+}
+
+# VCS understood by makepkg, without a backend yet
+UNSUPPORTED = ('svn', 'bzr', 'hg')
+
+
+class SourceBackendError(Exception):
+	def __init__(self, message = 'Source Error: no backend for this source'):
+		super(SourceBackendError, self).__init__(message)
+
+
+class FetchResult(object):
+	"""Outcome of fetching one source, as yielded by the fetch_all() of a backend"""
+	def __init__(self, url, filename = None, error = None, digests = None, extracted = None, members = None):
+		super(FetchResult, self).__init__()
+		self.url = url
+		self.filename = filename
+		self.error = error
+		self.digests = digests
+		self.extracted = extracted
+		self.members = members
+
+
+	@property
+	def ok(self):
+		return self.error is None
+
+
+def register(name, module, schemes = ()):
+	"""Add or replace a backend, implemented by module, for the given schemes"""
+	BACKENDS[name] = module
+	for scheme in schemes:
+		SCHEMES[scheme] = name
+
+
+def source_scheme(source):
+	"""Scheme of a [name::]url source: the VCS of vcs+url, the url scheme, or local for a path"""
+	url = source.rpartition('::')[2]
+	if '://' not in url:
+		return 'local'
+
+	return url.partition('://')[0].partition('+')[0]
+
+
+def backend_name(source):
+	scheme = source_scheme(source)
+	if scheme in SCHEMES:
+		return SCHEMES[scheme]
+
+	if scheme in UNSUPPORTED:
+		raise SourceBackendError('{0}: {1} is currently not supported.'.format(source, scheme))
+
+	raise SourceBackendError('{0}: {1} is an invalid scheme.'.format(source, scheme))
+
+
+def group_sources(sources):
+	"""Sources by backend name, in the order of their first appearance"""
+	groups = OrderedDict()
+	for source in sources:
+		groups.setdefault(backend_name(source), []).append(source)
+
+	return groups
+
+
+def load_backend(name):
+	"""Import the module of a backend, once"""
+	if name not in BACKENDS:
+		raise SourceBackendError('{} is not a registered backend.'.format(name))
+
+	try:
+		return import_module(BACKENDS[name])
+	except ImportError as e:
+		raise SourceBackendError('{0} sources cannot be fetched: {1}'.format(name, e))
+
+
+def preload():
+	"""Import every backend available, e.g. before a daemon starts forking jobs"""
+	for name in BACKENDS:
+		try:
+			load_backend(name)
+		except SourceBackendError:
+			pass
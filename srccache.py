@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from os import link, makedirs, remove, chmod
+from os.path import exists as path_exists, join as path_join, isfile, basename, getsize
+from fcntl import ioctl
+from shutil import copy2
+from hashlib import sha256
+from time import time
+from json import load as json_load, dump as json_dump
+
+from fileutil import atomic_write, locked
+
+
+# ioctl request number used by Linux to share extents between two files
+FICLONE = 0x40049409
+
+
+def link_or_copy(src, dst):
+	"""Place src at dst as a hardlink, falling back to a reflink and then to a plain copy"""
+	if path_exists(dst):
+		remove(dst)
+
+	try:
+		link(src, dst)
+		return
+	except OSError:
+		pass
+
+	try:
+		with open(src, 'rb') as s, open(dst, 'wb') as d:
+			ioctl(d.fileno(), FICLONE, s.fileno())
+		return
+	except OSError:
+		if path_exists(dst):
+			remove(dst)
+
+	copy2(src, dst)
+
+
+class SourceCache(object):
+	"""Shared, content-addressed cache of downloaded sources, similar to makepkg's SRCDEST"""
+	def __init__(self, rootdir, budget = 0):
+		super(SourceCache, self).__init__()
+		self.__rootdir = rootdir
+		self.__budget = budget
+		self.__objects = path_join(rootdir, 'objects')
+		self.__index_path = path_join(rootdir, 'index.json')
+		self.__lock_path = path_join(rootdir, 'lock')
+
+		makedirs(self.__objects, 0o755, exist_ok=True)
+
+
+	def __load_index(self):
+		if not isfile(self.__index_path):
+			return {'urls': {}, 'objects': {}}
+
+		with open(self.__index_path, 'r') as f:
+			return json_load(f)
+
+
+	def __save_index(self, index):
+		with atomic_write(self.__index_path) as f:
+			json_dump(index, f)
+
+
+	def __object_path(self, digest):
+		return path_join(self.__objects, digest[:2], digest)
+
+
+	@staticmethod
+	def hash_file(path):
+		h = sha256()
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				h.update(block)
+
+		return h.hexdigest()
+
+
+	def lookup(self, url, destdir):
+		"""Link the cached copy of url into destdir, returning its filename or None on a miss"""
+		with locked(self.__lock_path):
+			index = self.__load_index()
+			digest = index['urls'].get(url)
+			entry = index['objects'].get(digest)
+
+			if not entry or not isfile(self.__object_path(digest)):
+				return None
+
+			link_or_copy(self.__object_path(digest), path_join(destdir, entry['filename']))
+			entry['atime'] = time()
+			self.__save_index(index)
+
+			return entry['filename']
+
+
+	def store(self, url, path, digest = None):
+		"""Add the file at path to the cache under url and its content hash"""
+		if digest is None:
+			digest = self.hash_file(path)
+
+		with locked(self.__lock_path):
+			index = self.__load_index()
+			object_path = self.__object_path(digest)
+
+			if not isfile(object_path):
+				makedirs(path_join(self.__objects, digest[:2]), 0o755, exist_ok=True)
+				link_or_copy(path, object_path)
+				# Objects may be hardlinked into build trees: protect them from in-place edits
+				chmod(object_path, 0o444)
+
+			index['urls'][url] = digest
+			index['objects'][digest] = {
+				'filename': basename(path),
+				'size': getsize(object_path),
+				'atime': time()
+			}
+
+			self.__evict(index, keep=digest)
+			self.__save_index(index)
+
+		return digest
+
+
+	def __evict(self, index, keep = None):
+		"""Drop least recently used objects until the cache fits its budget"""
+		if self.__budget <= 0:
+			return
+
+		objects = index['objects']
+		total = sum(o['size'] for o in objects.values())
+
+		for digest in sorted(objects, key=lambda d: objects[d]['atime']):
+			if total <= self.__budget:
+				break
+
+			if digest == keep:
+				continue
+
+			if isfile(self.__object_path(digest)):
+				remove(self.__object_path(digest))
+
+			total -= objects.pop(digest)['size']
+
+		index['urls'] = {u: d for u, d in index['urls'].items() if d in objects}
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: latin-1 -*-
+#
+#	Copyright (c) 2018
+#	Angelone Alessandro <angelone.alessandro98@gmail.com>.
+# 	All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its contributors
+#    may be used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+from contextlib import contextmanager
+from resource import getrusage, RUSAGE_SELF, RUSAGE_CHILDREN
+from threading import Lock, get_ident
+from time import perf_counter, thread_time
+from json import dump as json_dump
+from os import getpid
+
+
+def peak_rss():
+	"""Peak resident set size of this process since the last reset, and of its largest child, in KiB"""
+	return max(getrusage(RUSAGE_SELF).ru_maxrss, getrusage(RUSAGE_CHILDREN).ru_maxrss)
+
+
+def reset_peak_rss():
+	"""Restart this process's peak RSS from its current RSS; False where the kernel does not allow it"""
+	try:
+		with open('/proc/self/clear_refs', 'w') as f:
+			f.write('5')
+		return True
+	except OSError:
+		return False
+
+
+def current_peak_rss():
+	"""Peak RSS of this process since the last reset, in KiB"""
+	try:
+		with open('/proc/self/status') as f:
+			for line in f:
+				if line.startswith('VmHWM:'):
+					return int(line.split()[1])
+	except OSError:
+		pass
+
+	return getrusage(RUSAGE_SELF).ru_maxrss
+
+
+def human_size(n):
+	for unit in ('B', 'KiB', 'MiB', 'GiB'):
+		if n < 1024 or unit == 'GiB':
+			return '{0:.1f} {1}'.format(n, unit) if unit != 'B' else '{} B'.format(n)
+		n /= 1024
+
+
+class Span(object):
+	"""One timed phase: wall and CPU time in seconds, bytes moved, peak RSS in KiB"""
+	__slots__ = ('name', 'category', 'start', 'wall', 'cpu', 'bytes', 'peak_rss', 'thread', 'args', 'shared')
+
+	def __init__(self, name, category, start, thread):
+		super(Span, self).__init__()
+		self.name = name
+		self.category = category
+		self.start = start
+		self.wall = 0.0
+		self.cpu = 0.0
+		self.bytes = 0
+		self.peak_rss = 0
+		self.thread = thread
+		self.args = {}
+		self.shared = False
+
+
+class Tracer(object):
+	"""Records the phases of a build, for --trace and --stats
+
+	CPU time counts the thread that runs the phase plus the children it
+	waited for. Children are reaped process-wide, so a phase that overlaps
+	one running on another thread (concurrent downloads, streamed
+	extraction) counts its own thread only.
+
+	Peak RSS is this process's high-water mark, restarted when a phase
+	begins with no other open, plus any child that set a new lifetime
+	high during the phase. Overlapping phases share the peak reached
+	since the earliest of them began. Without /proc/self/clear_refs the
+	high-water mark cannot be restarted and is the running maximum."""
+	def __init__(self):
+		super(Tracer, self).__init__()
+		self.__origin = perf_counter()
+		self.__lock = Lock()
+		self.__open = []
+		self.spans = []
+
+
+	@contextmanager
+	def span(self, name, category = 'build', **args):
+		"""Time the body of a with statement; the yielded Span's bytes and args may be filled in"""
+		span = Span(name, category, perf_counter() - self.__origin, get_ident())
+		span.args.update(args)
+
+		with self.__lock:
+			if not self.__open:
+				reset_peak_rss()
+			for other in self.__open:
+				if other.thread != span.thread:
+					other.shared = span.shared = True
+			self.__open.append(span)
+
+		cpu = thread_time()
+		children = getrusage(RUSAGE_CHILDREN)
+
+		try:
+			yield span
+		finally:
+			span.wall = perf_counter() - self.__origin - span.start
+			reaped = getrusage(RUSAGE_CHILDREN)
+			span.peak_rss = current_peak_rss()
+			if reaped.ru_maxrss > children.ru_maxrss:
+				span.peak_rss = max(span.peak_rss, reaped.ru_maxrss)
+
+			with self.__lock:
+				self.__open.remove(span)
+				span.cpu = thread_time() - cpu
+				if not span.shared:
+					span.cpu += reaped.ru_utime + reaped.ru_stime - children.ru_utime - children.ru_stime
+				self.spans.append(span)
+
+
+	def write_chrome_trace(self, path):
+		"""Write the spans in Chrome trace-event format, for chrome://tracing or Perfetto"""
+		pid = getpid()
+		threads = {}
+		events = []
+
+		for span in sorted(self.spans, key=lambda s: s.start):
+			tid = threads.setdefault(span.thread, len(threads) + 1)
+			args = dict(span.args, cpu_ms=round(span.cpu * 1000, 3), bytes=span.bytes, peak_rss_kib=span.peak_rss)
+			events.append({
+				'name': span.name, 'cat': span.category, 'ph': 'X', 'pid': pid, 'tid': tid,
+				'ts': round(span.start * 1e6), 'dur': round(span.wall * 1e6), 'args': args
+			})
+
+		with open(path, 'w') as f:
+			json_dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+	def print_stats(self):
+		spans = sorted(self.spans, key=lambda s: s.start)
+		width = max([len(s.name) for s in spans] + [5])
+		row = '{0:<{w}}  {1:>9}  {2:>9}  {3:>11}  {4:>11}'
+
+		print(row.format('phase', 'wall', 'cpu', 'bytes', 'peak rss', w=width))
+		for s in spans:
+			print(row.format(s.name, '{:.3f}s'.format(s.wall), '{:.3f}s'.format(s.cpu), human_size(s.bytes),
+				human_size(s.peak_rss << 10), w=width))
+
+		total = perf_counter() - self.__origin
+		print(row.format('total', '{:.3f}s'.format(total), '', human_size(sum(s.bytes for s in spans)),
+			human_size(max([s.peak_rss for s in spans] + [peak_rss()]) << 10), w=width))